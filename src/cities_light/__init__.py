@@ -1,15 +1,25 @@
 from .signals import (
     city_items_post_import,
     city_items_pre_import,
+    city_items_pre_import_batch,
     country_items_post_import,
     country_items_pre_import,
+    country_items_pre_import_batch,
     region_items_post_import,
     region_items_pre_import,
+    region_items_pre_import_batch,
     subregion_items_post_import,
     subregion_items_pre_import,
+    subregion_items_pre_import_batch,
     translation_items_pre_import,
+    translation_items_pre_import_batch,
+)
+from .exceptions import (
+    CitiesLightException,
+    IncompleteDownload,
+    InvalidItems,
+    SourceFileDoesNotExist,
 )
-from .exceptions import CitiesLightException, InvalidItems, SourceFileDoesNotExist
 from .settings import (
     FIXTURES_BASE_URL,
     COUNTRY_SOURCES,
@@ -23,6 +33,7 @@ from .settings import (
     INDEX_SEARCH_NAMES,
     INCLUDE_COUNTRIES,
     INCLUDE_CITY_TYPES,
+    MIN_CITY_POPULATION,
     DEFAULT_APP_NAME,
     CITIES_LIGHT_APP_NAME,
     ICountry,
@@ -35,17 +46,23 @@ from . import version
 
 __all__ = [
     "CitiesLightException",
+    "IncompleteDownload",
     "InvalidItems",
     "SourceFileDoesNotExist",
     "city_items_post_import",
     "city_items_pre_import",
+    "city_items_pre_import_batch",
     "country_items_post_import",
     "country_items_pre_import",
+    "country_items_pre_import_batch",
     "region_items_post_import",
     "region_items_pre_import",
+    "region_items_pre_import_batch",
     "subregion_items_post_import",
     "subregion_items_pre_import",
+    "subregion_items_pre_import_batch",
     "translation_items_pre_import",
+    "translation_items_pre_import_batch",
     "FIXTURES_BASE_URL",
     "COUNTRY_SOURCES",
     "REGION_SOURCES",
@@ -58,6 +75,7 @@ __all__ = [
     "INDEX_SEARCH_NAMES",
     "INCLUDE_COUNTRIES",
     "INCLUDE_CITY_TYPES",
+    "MIN_CITY_POPULATION",
     "DEFAULT_APP_NAME",
     "CITIES_LIGHT_APP_NAME",
     "ICountry",
@@ -7,12 +7,17 @@ import os
 from urllib.request import Request, urlopen
 from urllib.parse import urlparse
 
-from .exceptions import SourceFileDoesNotExist
+from .exceptions import IncompleteDownload, SourceFileDoesNotExist
 
 
 class Downloader:
     """Geonames data downloader class."""
 
+    # bytes read from the source and written at once
+    chunk_size = 1 << 20
+    # seconds between the progress logs of a download
+    log_interval = 10
+
     def download(self, source: str, destination: str, force: bool = False):
         """Download source file/url to destination."""
         logger = logging.getLogger("cities_light")
@@ -30,12 +35,59 @@ class Downloader:
             return False
         # If the files are different, download/copy happens
         logger.info("Downloading %s into %s", source, destination)
-        with urlopen(source) as source_stream:
-            with open(destination, "wb") as local_file:
-                local_file.write(source_stream.read())
-
+        self.stream(source, destination)
         return True
 
+    def stream(self, source: str, destination: str):
+        """
+        Copy source to destination by chunks of chunk_size bytes, logging
+        the bytes per second.
+
+        Chunks are written to a destination.part file which replaces
+        destination once complete, so that an interrupted download never
+        leaves a truncated destination that needs_downloading() would
+        mistake for current.
+        """
+        logger = logging.getLogger("cities_light")
+        temporary_path = destination + ".part"
+        start = time.monotonic()
+        next_log = start + self.log_interval
+        received = 0
+        try:
+            with urlopen(source) as source_stream:
+                expected = source_stream.headers.get("content-length")
+                with open(temporary_path, "wb") as local_file:
+                    for chunk in iter(lambda: source_stream.read(self.chunk_size), b""):
+                        local_file.write(chunk)
+                        received += len(chunk)
+
+                        now = time.monotonic()
+                        if now >= next_log:
+                            next_log = now + self.log_interval
+                            logger.info(
+                                "Downloaded %s bytes of %s (%d bytes/s)",
+                                received,
+                                source,
+                                received / (now - start),
+                            )
+
+            if expected is not None and received != int(expected):
+                raise IncompleteDownload(source, received, expected)
+            os.replace(temporary_path, destination)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+        elapsed = time.monotonic() - start
+        logger.info(
+            "Downloaded %s bytes of %s in %.1fs (%d bytes/s)",
+            received,
+            source,
+            elapsed,
+            received / elapsed if elapsed else received,
+        )
+
     @staticmethod
     def source_matches_destination(source: str, destination: str):
         """Return True if source and destination point to the same file."""
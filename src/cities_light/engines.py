@@ -0,0 +1,303 @@
+"""
+Engines used by the cities_light command to write chunks of rows with
+--batch-size.
+
+.. py:data:: ENGINES
+
+    Dict of --engine option values to engine classes.
+"""
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+
+from django.db import connections, models
+
+__all__ = [
+    "OrmEngine",
+    "CopyEngine",
+    "LoadDataEngine",
+    "SqliteEngine",
+    "ENGINES",
+]
+
+
+def to_tsv(fields, instances):
+    """
+    Return the values of fields for instances in the tab separated text
+    format understood by both PostgreSQL COPY and MySQL LOAD DATA.
+    """
+    lines = []
+    for instance in instances:
+        values = []
+        for field in fields:
+            value = field.get_prep_value(getattr(instance, field.attname))
+            if value is None:
+                values.append("\\N")
+                continue
+            if isinstance(field, models.JSONField):
+                value = json.dumps(value, cls=field.encoder)
+            values.append(
+                str(value)
+                .replace("\\", "\\\\")
+                .replace("\t", "\\t")
+                .replace("\n", "\\n")
+                .replace("\r", "\\r")
+            )
+        lines.append("\t".join(values))
+    return "\n".join(lines) + "\n"
+
+
+class OrmEngine:
+    """Write with bulk_create() and bulk_update(), works with any database."""
+
+    vendor = None
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    @classmethod
+    def check(cls, connection):
+        """Return why the engine cannot be used with connection, or None."""
+        if cls.vendor and cls.vendor != connection.vendor:
+            return "requires %s" % cls.vendor
+
+    @contextlib.contextmanager
+    def session(self, connection):
+        """Context manager wrapping the whole import."""
+        yield
+
+    def write(self, model_class, created, updated, fields, using):
+        """Insert created and update updated instances of model_class."""
+        if created:
+            model_class.objects.using(using).bulk_create(
+                created, batch_size=self.batch_size
+            )
+        if updated:
+            model_class.objects.using(using).bulk_update(
+                updated, [f.name for f in fields], batch_size=self.batch_size
+            )
+
+
+class CopyEngine(OrmEngine):
+    """
+    PostgreSQL engine which streams rows into a temporary staging table with
+    COPY FROM STDIN and merges them into the model table with a single
+    INSERT ... ON CONFLICT (geoname_id) DO UPDATE query.
+    """
+
+    vendor = "postgresql"
+
+    def write(self, model_class, created, updated, fields, using):
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        table = qn(model_class._meta.db_table)
+        staging = qn("%s_staging" % model_class._meta.db_table)
+        columns = ", ".join(qn(f.column) for f in fields)
+        merged = [qn(f.column) for f in fields if f.attname != "geoname_id"]
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS %s AS"
+                " SELECT %s FROM %s WITH NO DATA" % (staging, columns, table)
+            )
+            cursor.execute("TRUNCATE %s" % staging)
+
+            data = to_tsv(fields, created + updated)
+            copy_sql = "COPY %s (%s) FROM STDIN" % (staging, columns)
+            if hasattr(cursor.cursor, "copy"):
+                # psycopg 3
+                with cursor.cursor.copy(copy_sql) as copy:
+                    copy.write(data)
+            else:
+                # psycopg2
+                cursor.cursor.copy_expert(copy_sql, io.StringIO(data))
+
+            cursor.execute(
+                "INSERT INTO %(table)s AS t (%(columns)s)"
+                " SELECT %(columns)s FROM %(staging)s"
+                " ON CONFLICT (%(geoname_id)s) DO UPDATE SET %(set)s"
+                " WHERE (%(old)s) IS DISTINCT FROM (%(new)s)"
+                % dict(
+                    table=table,
+                    columns=columns,
+                    staging=staging,
+                    geoname_id=qn(model_class._meta.get_field("geoname_id").column),
+                    set=", ".join("%s = EXCLUDED.%s" % (c, c) for c in merged),
+                    old=", ".join("t.%s" % c for c in merged),
+                    new=", ".join("EXCLUDED.%s" % c for c in merged),
+                )
+            )
+
+
+class LoadDataEngine(OrmEngine):
+    """
+    MySQL engine which writes rows to a temporary TSV file, loads it into a
+    temporary staging table with LOAD DATA LOCAL INFILE and merges it into
+    the model table with an UPDATE ... JOIN of the existing geoname ids and
+    an INSERT ... SELECT of the new ones.
+
+    Unlike ON DUPLICATE KEY UPDATE, which matches any unique key, rows are
+    only merged by geoname_id, so that a name or slug taken by another row
+    raises an IntegrityError.
+
+    LOCAL INFILE must be allowed by the server (local_infile=ON) and the
+    client, ie. with ``'OPTIONS': {'local_infile': 1}`` in the database
+    settings.
+    """
+
+    vendor = "mysql"
+
+    @classmethod
+    def check(cls, connection):
+        error = super().check(connection)
+        if error:
+            return error
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT @@GLOBAL.local_infile")
+            if not cursor.fetchone()[0]:
+                return "requires local_infile to be enabled on the MySQL server"
+
+    def write(self, model_class, created, updated, fields, using):
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        table = qn(model_class._meta.db_table)
+        staging = qn("%s_staging" % model_class._meta.db_table)
+        columns = ", ".join(qn(f.column) for f in fields)
+        geoname_id = qn(model_class._meta.get_field("geoname_id").column)
+        merged = [qn(f.column) for f in fields if f.attname != "geoname_id"]
+
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", suffix=".tsv", delete=False
+        ) as tsv:
+            tsv.write(to_tsv(fields, created + updated))
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "CREATE TEMPORARY TABLE IF NOT EXISTS %s"
+                    " SELECT %s FROM %s LIMIT 0" % (staging, columns, table)
+                )
+                # unlike TRUNCATE, DELETE does not commit the transaction
+                cursor.execute("DELETE FROM %s" % staging)
+                cursor.execute(
+                    "LOAD DATA LOCAL INFILE %%s INTO TABLE %s"
+                    " CHARACTER SET utf8mb4 (%s)" % (staging, columns),
+                    [tsv.name],
+                )
+                cursor.execute(
+                    "UPDATE %(table)s AS t JOIN %(staging)s AS s"
+                    " ON t.%(geoname_id)s = s.%(geoname_id)s SET %(set)s"
+                    % dict(
+                        table=table,
+                        staging=staging,
+                        geoname_id=geoname_id,
+                        set=", ".join("t.%s = s.%s" % (c, c) for c in merged),
+                    )
+                )
+                cursor.execute(
+                    "INSERT INTO %(table)s (%(columns)s)"
+                    " SELECT %(values)s FROM %(staging)s AS s"
+                    " LEFT JOIN %(table)s AS t"
+                    " ON t.%(geoname_id)s = s.%(geoname_id)s"
+                    " WHERE t.%(geoname_id)s IS NULL"
+                    % dict(
+                        table=table,
+                        columns=columns,
+                        values=", ".join("s.%s" % qn(f.column) for f in fields),
+                        staging=staging,
+                        geoname_id=geoname_id,
+                    )
+                )
+        finally:
+            os.unlink(tsv.name)
+
+
+class SqliteEngine(OrmEngine):
+    """
+    SQLite engine which writes rows with a single executemany() INSERT ...
+    ON CONFLICT (geoname_id) DO UPDATE query.
+
+    Outside of a transaction, the journal, synchronous and cache_size pragmas
+    are tuned for speed rather than durability for the duration of the
+    import, and restored afterwards.
+    """
+
+    vendor = "sqlite"
+    pragmas = {
+        "journal_mode": "MEMORY",
+        "synchronous": "OFF",
+        "cache_size": -65536,  # 64MB
+    }
+
+    @classmethod
+    def check(cls, connection):
+        error = super().check(connection)
+        if error:
+            return error
+
+        if connection.Database.sqlite_version_info < (3, 24):
+            return "requires SQLite 3.24 or later"
+
+    @contextlib.contextmanager
+    def session(self, connection):
+        if connection.in_atomic_block:
+            # journal_mode and synchronous cannot change in a transaction
+            yield
+            return
+
+        with connection.cursor() as cursor:
+            previous = {}
+            for pragma, value in self.pragmas.items():
+                cursor.execute("PRAGMA %s" % pragma)
+                previous[pragma] = cursor.fetchone()[0]
+                cursor.execute("PRAGMA %s = %s" % (pragma, value))
+
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                for pragma, value in previous.items():
+                    cursor.execute("PRAGMA %s = %s" % (pragma, value))
+
+    def write(self, model_class, created, updated, fields, using):
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        merged = [qn(f.column) for f in fields if f.attname != "geoname_id"]
+
+        sql = (
+            "INSERT INTO %(table)s (%(columns)s) VALUES (%(values)s)"
+            " ON CONFLICT (%(geoname_id)s) DO UPDATE SET %(set)s"
+            % dict(
+                table=qn(model_class._meta.db_table),
+                columns=", ".join(qn(f.column) for f in fields),
+                values=", ".join(["%s"] * len(fields)),
+                geoname_id=qn(model_class._meta.get_field("geoname_id").column),
+                set=", ".join("%s = excluded.%s" % (c, c) for c in merged),
+            )
+        )
+
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                sql,
+                [
+                    [
+                        field.get_db_prep_save(
+                            getattr(instance, field.attname), connection
+                        )
+                        for field in fields
+                    ]
+                    for instance in created + updated
+                ],
+            )
+
+
+ENGINES = {
+    "orm": OrmEngine,
+    "copy": CopyEngine,
+    "load-data": LoadDataEngine,
+    "sqlite": SqliteEngine,
+}
@@ -18,3 +18,12 @@ class SourceFileDoesNotExist(CitiesLightException):
 
     def __init__(self, source):
         super().__init__("%s does not exist" % source)
+
+
+class IncompleteDownload(CitiesLightException):
+    """A download ended before all the bytes of the source were received."""
+
+    def __init__(self, source, received, expected):
+        super().__init__(
+            "%s: received %s bytes out of %s" % (source, received, expected)
+        )
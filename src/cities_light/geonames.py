@@ -1,16 +1,64 @@
+import array
+import bisect
+import contextlib
+import io
 import os.path
+import shutil
 import zipfile
 import logging
 from urllib.parse import urlparse
 
 from .settings import DATA_DIR
 from .downloader import Downloader
+from .hashes import row_hash
+
+
+def line_filter(conditions):
+    """
+    Compile conditions, a dict of column index: function of the stripped
+    column value, into a predicate of raw lines for :py:meth:`Geonames.parse`,
+    or return None if there are no conditions.
+
+    The predicate only splits the columns it needs, and rejects lines which
+    do not have them.
+    """
+    if not conditions:
+        return None
+
+    conditions = sorted(conditions.items())
+    maxsplit = conditions[-1][0] + 1
+
+    def predicate(line):
+        fields = line.split("\t", maxsplit)
+        if len(fields) < maxsplit:
+            return False
+        for column, condition in conditions:
+            if not condition(fields[column].strip()):
+                return False
+        return True
+
+    return predicate
 
 
 class Geonames:
     logger = logging.getLogger("cities_light")
 
-    def __init__(self, url: str, force: bool = False):
+    # name of the source file in the file_path zip archive, None if
+    # file_path is the source file itself
+    member = None
+    # path of the zip archive of the source, extracted or not
+    archive_path = None
+
+    # binary file of the source being read, for tell()
+    _reading = None
+
+    def __init__(
+        self,
+        url: str,
+        force: bool = False,
+        download: bool = True,
+        extract: bool = False,
+    ):
         # Creating a directory if not exist
         if not os.path.exists(DATA_DIR):
             self.logger.info("Creating %s", DATA_DIR)
@@ -19,19 +67,20 @@ class Geonames:
         destination_file_name = url.split("/")[-1]
         self.file_path = os.path.join(DATA_DIR, destination_file_name)
 
-        self.downloaded = self.download(url=url, path=self.file_path, force=force)
-
-        # Extract the destination file, use the extracted file as new
-        # destination
-        destination_file_name = destination_file_name.replace("zip", "txt")
+        self.downloaded = False
+        if download:
+            self.downloaded = self.download(url=url, path=self.file_path, force=force)
 
-        destination = os.path.join(DATA_DIR, destination_file_name)
-        exists = os.path.exists(destination)
-        # If the file is a zipped file then extract it
+        # zip archives are read without extracting them unless extract is
+        # True
         url_path = urlparse(url).path
-        if url_path.lower().endswith(".zip") and not exists:
-            self.extract(self.file_path, destination_file_name)
-        self.file_path = os.path.join(DATA_DIR, destination_file_name)
+        if url_path.lower().endswith(".zip"):
+            self.archive_path = self.file_path
+            member = os.path.splitext(destination_file_name)[0] + ".txt"
+            if extract:
+                self.file_path = self.extract(self.file_path, member)
+            else:
+                self.member = member
 
     @staticmethod
     def download(url, path, force=False):
@@ -41,13 +90,104 @@ class Geonames:
         return downloader.download(source=url, destination=path, force=force)
 
     def extract(self, zip_path, file_name):
-        self.logger.info("Extracting %s from %s into %s", file_name, zip_path, DATA_DIR)
+        """
+        Extract file_name from the zip_path archive into DATA_DIR and return
+        its path.
+
+        The CRC of file_name and the mtime of the archive are kept in a
+        .extracted file next to it, the file is only extracted again when
+        they change.
+        """
+        path = os.path.join(DATA_DIR, file_name)
+        stamp_path = path + ".extracted"
         with zipfile.ZipFile(zip_path) as zip_file:
-            zip_file.extract(file_name, DATA_DIR)
+            stamp = "%08x %r" % (
+                zip_file.getinfo(file_name).CRC,
+                os.path.getmtime(zip_path),
+            )
+            if os.path.exists(path) and os.path.exists(stamp_path):
+                with open(stamp_path) as f:
+                    if f.read() == stamp:
+                        return path
+
+            self.logger.info(
+                "Extracting %s from %s into %s", file_name, zip_path, DATA_DIR
+            )
+            with zip_file.open(file_name) as source:
+                with open(path + ".tmp", "wb") as destination:
+                    shutil.copyfileobj(source, destination, 1 << 20)
+        os.replace(path + ".tmp", path)
 
-    def parse(self):
-        with open(self.file_path, encoding="utf-8", mode="r") as file:
+        with open(stamp_path, "w") as f:
+            f.write(stamp)
+        return path
+
+    @contextlib.contextmanager
+    def open(self, path=None, binary=False):
+        """
+        Open path, or the source file, in text mode or in binary if binary is
+        True. Bytes read from the source file are reported by tell().
+
+        If the source is a zip archive, its member is decompressed while it
+        is read. path is then an archive too, such as imported_path.
+        """
+        path = path or self.file_path
+        with contextlib.ExitStack() as stack:
+            file = stack.enter_context(open(path, mode="rb"))
+            if self.member is not None:
+                zip_file = stack.enter_context(zipfile.ZipFile(file))
+                file = stack.enter_context(zip_file.open(self.member))
+
+            if path == self.file_path:
+                self._reading = file
+            try:
+                if binary:
+                    yield io.BufferedReader(file) if self.member else file
+                else:
+                    yield io.TextIOWrapper(file, encoding="utf-8")
+            finally:
+                if self._reading is file:
+                    self._reading = None
+
+    def size(self):
+        """
+        Return the size of the source file, or of its member if it is a zip
+        archive, which is what tell() counts up to.
+        """
+        if self.member is None:
+            return os.path.getsize(self.file_path)
+        with zipfile.ZipFile(self.file_path) as zip_file:
+            return zip_file.getinfo(self.member).file_size
+
+    def tell(self):
+        """
+        Return the number of bytes read from the source file by the current
+        parse() or parse_matching(), or its size() once it is closed.
+
+        Reads are buffered, so this is the end of the last chunk read, which
+        is precise enough to show progress without counting lines first.
+        """
+        if self._reading is not None:
+            return self._reading.tell()
+        return self.size()
+
+    @property
+    def imported_path(self):
+        """Path of the copy of the file kept by mark_imported()."""
+        return self.file_path + ".imported"
+
+    def parse(self, path=None, line_filter=None):
+        """
+        Yield the lists of stripped columns of the lines of path, or of the
+        source file, which are neither empty nor comments.
+
+        Lines are skipped before they are split if the line_filter predicate
+        returns False for them.
+        """
+        with self.open(path) as file:
             for line in file:
+                if line_filter is not None and not line_filter(line):
+                    continue
                 line = line.strip()
                 # If the line is blank/empty or a comment, skip it and continue
                 if len(line) < 1 or line[0] == "#":
@@ -55,6 +195,144 @@ class Geonames:
                 # Split on tab character and strip the new line character
                 yield [e.strip() for e in line.split("\t")]
 
+    def parse_matching(self, column, values):
+        """
+        Yield the rows of parse() which have one of values in column.
+
+        Lines are read in binary and their column is compared with the encoded
+        values before they are decoded and split, which saves most of the work
+        when few lines match, ie. the languages of alternateNames.
+        """
+        patterns = frozenset(value.encode("utf-8") for value in values)
+        with self.open(binary=True) as file:
+            for line in file:
+                fields = line.split(b"\t", column + 1)
+                if len(fields) <= column or fields[column].strip() not in patterns:
+                    continue
+
+                line = line.decode("utf-8").strip()
+                if len(line) < 1 or line[0] == "#":
+                    continue
+                yield [e.strip() for e in line.split("\t")]
+
+    def diff(self, column, tag=None):
+        """
+        Yield ("added" or "changed" or "unchanged" or "removed", items) for
+        the rows of parse() and the removed rows of the copy kept by
+        mark_imported(), rows being identified by their column value.
+
+        Only hashes of the rows of the copy are kept in memory, removed rows
+        are read from the copy again once the file is parsed. All rows are
+        added if there is no copy, or if tag is set and the copy was not
+        written by write_imported() with the same tag.
+        """
+        if not os.path.exists(self.imported_path) or (
+            tag is not None and self._imported_tag() != tag
+        ):
+            for items in self.parse():
+                yield "added", items
+            return
+
+        keys = array.array("Q")
+        hashes = array.array("Q")
+        for items in self.parse(self.imported_path):
+            if len(items) > column:
+                keys.append(row_hash(items[column]))
+                hashes.append(row_hash("\t".join(items)))
+
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        keys = array.array("Q", (keys[i] for i in order))
+        hashes = array.array("Q", (hashes[i] for i in order))
+        del order
+
+        # rows with the same key share the index of the first one
+        seen = bytearray(len(keys))
+        for items in self.parse():
+            if len(items) <= column:
+                yield "added", items
+                continue
+
+            key = row_hash(items[column])
+            index = bisect.bisect_left(keys, key)
+            if index == len(keys) or keys[index] != key:
+                yield "added", items
+                continue
+
+            seen[index] = 1
+            if hashes[index] != row_hash("\t".join(items)):
+                yield "changed", items
+            else:
+                yield "unchanged", items
+
+        for items in self.parse(self.imported_path):
+            if len(items) > column:
+                index = bisect.bisect_left(keys, row_hash(items[column]))
+                if not seen[index]:
+                    yield "removed", items
+
+    def mark_imported(self):
+        """Keep a copy of the file for the next diff()."""
+        shutil.copyfile(self.file_path, self.imported_path + ".tmp")
+        os.replace(self.imported_path + ".tmp", self.imported_path)
+
+    def _imported_tag(self):
+        """Return the tag of the copy written by write_imported(), or None."""
+        with self.open(self.imported_path) as file:
+            line = file.readline()
+        if line.startswith("# tag: "):
+            return line[len("# tag: ") :].rstrip("\n")
+        return None
+
+    @contextlib.contextmanager
+    def write_imported(self, tag=None):
+        """
+        Context manager yielding a function which adds the items of a row to
+        a new copy for the next diff(), so that only rows which were actually
+        imported are kept.
+
+        The new copy replaces the previous one on exit, unless an exception
+        was raised. It is a zip archive of the member if the source is one.
+        If set, tag is written in a comment on the first line, for diff() to
+        check it.
+        """
+        temporary_path = self.imported_path + ".tmp"
+        try:
+            with contextlib.ExitStack() as stack:
+                file = stack.enter_context(open(temporary_path, "wb"))
+                if self.member is not None:
+                    zip_file = stack.enter_context(
+                        zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED)
+                    )
+                    file = stack.enter_context(
+                        zip_file.open(self.member, "w", force_zip64=True)
+                    )
+
+                def add(items):
+                    file.write(("\t".join(items) + "\n").encode("utf-8"))
+
+                if tag is not None:
+                    file.write(("# tag: %s\n" % tag).encode("utf-8"))
+
+                yield add
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        os.replace(temporary_path, self.imported_path)
+
+    def forget_imported(self):
+        """
+        Remove the copy kept for diff(), which is stale once the file is
+        imported without it, whether the archive was extracted or not.
+        """
+        paths = {self.imported_path}
+        if self.archive_path is not None:
+            paths.add(self.archive_path + ".imported")
+            paths.add(os.path.splitext(self.archive_path)[0] + ".txt.imported")
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
     def num_lines(self):
-        with open(self.file_path, encoding="utf-8") as file:
+        with self.open() as file:
             return sum(1 for _ in file)
@@ -0,0 +1,85 @@
+"""
+Hashes of the rows imported from a source, used by the --hash-rows option
+to skip rows which did not change since the last import.
+"""
+
+import array
+import bisect
+import hashlib
+import json
+import os
+
+__all__ = ["RowHashes", "row_hash"]
+
+VERSION = 1
+
+
+def row_hash(value):
+    """Return a 64 bit hash of the value string."""
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class RowHashes:
+    """
+    Hashes of rows by geoname_id, stored in the path file.
+
+    Hashes of the previous import are loaded in sorted arrays if the file
+    was written for the same tag dict. Hashes added during the import
+    replace them all on :py:meth:`save`, so rows which are not imported
+    anymore are forgotten.
+    """
+
+    def __init__(self, path, tag):
+        self.path = path
+        self.tag = tag
+        self.geoname_ids = array.array("q")
+        self.hashes = array.array("Q")
+        self._added_geoname_ids = array.array("q")
+        self._added_hashes = array.array("Q")
+        self.load()
+
+    def load(self):
+        """Load hashes from the file if it matches the tag."""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "rb") as f:
+            header = json.loads(f.readline())
+            if header["version"] != VERSION or header["tag"] != self.tag:
+                return
+
+            self.geoname_ids.fromfile(f, header["count"])
+            self.hashes.fromfile(f, header["count"])
+
+    def get(self, geoname_id):
+        """Return the hash of the previous import for geoname_id, or None."""
+        index = bisect.bisect_left(self.geoname_ids, geoname_id)
+        if index < len(self.geoname_ids) and self.geoname_ids[index] == geoname_id:
+            return self.hashes[index]
+
+    def add(self, geoname_id, value):
+        """Add the hash of an imported row, the last one wins."""
+        self._added_geoname_ids.append(geoname_id)
+        self._added_hashes.append(value)
+
+    def save(self):
+        """Write the added hashes to the file."""
+        added_geoname_ids = self._added_geoname_ids
+        geoname_ids = array.array("q")
+        hashes = array.array("Q")
+        for index in sorted(
+            range(len(added_geoname_ids)), key=added_geoname_ids.__getitem__
+        ):
+            if geoname_ids and geoname_ids[-1] == added_geoname_ids[index]:
+                hashes[-1] = self._added_hashes[index]
+                continue
+            geoname_ids.append(added_geoname_ids[index])
+            hashes.append(self._added_hashes[index])
+
+        header = dict(version=VERSION, tag=self.tag, count=len(geoname_ids))
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            geoname_ids.tofile(f)
+            hashes.tofile(f)
+        os.replace(self.path + ".tmp", self.path)
@@ -1,17 +1,30 @@
+import array
 import collections
+import contextlib
+import json
+import concurrent.futures
+import decimal
+import functools
+import hashlib
 import itertools
 import os
 import datetime
 import logging
+import time
 from argparse import RawTextHelpFormatter
 
 import psutil
 import pickle
+import zlib
+from urllib.error import URLError
 
+import django
 from django.conf import settings
-from django.db import transaction, connection
+from django.db import transaction, connection, connections, router
 from django.db import reset_queries, IntegrityError
-from django.core.management.base import BaseCommand
+from django.db.models import signals
+from django.db.models.deletion import Collector
+from django.core.management.base import BaseCommand, CommandError
 from django.core.exceptions import ValidationError
 
 import progressbar
@@ -23,6 +36,10 @@ from ...settings import (
     CITY_SOURCES,
     TRANSLATION_SOURCES,
     DATA_DIR,
+    INCREMENTAL_BASE_URL,
+    INCLUDE_CITY_TYPES,
+    INCLUDE_COUNTRIES,
+    MIN_CITY_POPULATION,
     TRANSLATION_LANGUAGES,
     ICountry,
     IRegion,
@@ -36,24 +53,172 @@ from ...signals import (
     subregion_items_pre_import,
     city_items_pre_import,
     translation_items_pre_import,
+    country_items_pre_import_batch,
+    region_items_pre_import_batch,
+    subregion_items_pre_import_batch,
+    city_items_pre_import_batch,
+    translation_items_pre_import_batch,
     country_items_post_import,
     region_items_post_import,
     subregion_items_post_import,
     city_items_post_import,
 )
-from ...exceptions import InvalidItems
-from ...geonames import Geonames
+from ...abstract_models import to_ascii
+from ...engines import ENGINES, OrmEngine
+from ...hashes import RowHashes, row_hash
+from ...slugs import SlugPlanner
+from ...related import cache_related, clear_related_cache, related_cache
+from ...receivers import (
+    city_search_names,
+    filter_non_cities,
+    filter_non_included_countries_city,
+    filter_non_included_countries_country,
+    filter_non_included_countries_region,
+    filter_non_included_countries_subregion,
+    filter_small_cities,
+    get_names,
+    get_search_names,
+    set_display_name,
+    suspend_derived_fields,
+)
+from ...translations import (
+    TranslationStore,
+    read_translation_cache,
+    source_tag,
+    write_translation_cache,
+)
+from ...exceptions import InvalidItems, SourceFileDoesNotExist
+from ...geonames import Geonames, line_filter
 from ...loading import get_cities_models
 from ...validators import timezone_validator
 
 Country, Region, SubRegion, City = get_cities_models()
 
+# signals sent with chunks of the rows of each model source
+PRE_IMPORT_BATCH_SIGNALS = {
+    Country: country_items_pre_import_batch,
+    Region: region_items_pre_import_batch,
+    SubRegion: subregion_items_pre_import_batch,
+    City: city_items_pre_import_batch,
+}
+
+# chunk size of translations, and of rows with an --engine other than orm,
+# when --batch-size is not set
+DEFAULT_BATCH_SIZE = 5000
+
+# minimum number of seconds between two redraws of the progress bar
+PROGRESS_INTERVAL = 0.2
+
+# daily files applied by --incremental, named <name>-<yyyy-mm-dd>.txt
+INCREMENTAL_SOURCES = [
+    "modifications",
+    "deletes",
+    "alternateNamesModifications",
+    "alternateNamesDeletes",
+]
+
+
+def country_shard(country_code2, shards):
+    """Return the stable shard number of a country code."""
+    return zlib.crc32(country_code2.encode()) % shards
+
+
+class GeonameIds:
+    """
+    Set of geoname ids found in sources for --prune, stored in a bitmap of
+    one bit per id up to the largest, ie. less than 2MB for all geonames.
+    """
+
+    __slots__ = ("bits",)
+
+    def __init__(self):
+        self.bits = bytearray()
+
+    def add(self, geoname_id):
+        """Add geoname_id, negative ids are ignored."""
+        if geoname_id < 0:
+            return
+        index = geoname_id >> 3
+        if index >= len(self.bits):
+            # grow geometrically, sources are usually sorted by geoname id
+            self.bits.extend(bytes(max(index + 1 - len(self.bits), len(self.bits))))
+        self.bits[index] |= 1 << (geoname_id & 7)
+
+    def update(self, other):
+        """Add the geoname ids of the other GeonameIds."""
+        size = len(other.bits)
+        if size > len(self.bits):
+            self.bits.extend(bytes(size - len(self.bits)))
+        merged = int.from_bytes(self.bits[:size], "little") | int.from_bytes(
+            other.bits, "little"
+        )
+        self.bits[:size] = merged.to_bytes(size, "little")
+
+    def __contains__(self, geoname_id):
+        index = geoname_id >> 3
+        return 0 <= index < len(self.bits) and bool(
+            self.bits[index] & 1 << (geoname_id & 7)
+        )
+
+
+def city_import_worker(url, shard, shards, options):
+    """
+    Import the cities of the url source which country belongs to shard, in
+    a worker process of Command.city_import_parallel().
+
+    Return the import stats, and the geoname ids of the rows of the shard
+    with the prune option, or None.
+    """
+    command = Command()
+    command._clear_identity_maps()
+    command.noinsert = options["noinsert"]
+    command.keep_slugs = options["keep_slugs"]
+    command.batch_size = options["batch_size"]
+    command.hash_rows = False
+    command.prune = options["prune"]
+    command._seen_geoname_ids = {}
+    command.engine = options["engine"](command.batch_size)
+    command.progress_enabled = False
+    command.stats = collections.Counter()
+
+    # derived fields are set by chunk in bulk_save() only, forked workers
+    # inherit the receivers suspended by the parent process
+    suspend = contextlib.nullcontext
+    if command.batch_size:
+        suspend = functools.partial(
+            command.suspend_derived_fields, options["suspended_receivers"]
+        )
+
+    geonames = Geonames(url, download=False, extract=options["extract"])
+    with related_cache(), suspend():
+        command.import_source(
+            url,
+            geonames.parse(
+                line_filter=command.source_line_filter(City, shard=(shard, shards))
+            ),
+        )
+    return command.stats, command._seen_geoname_ids.get(City)
+
 
 class MemoryUsageWidget(progressbar.widgets.WidgetBase):
+    """Memory used by the process, measured at most every interval seconds."""
+
+    def __init__(self, interval=1, **kwargs):
+        super().__init__(**kwargs)
+        self.interval = interval
+        # created on first use, progressbar deep copies widgets
+        self.process = None
+        self.rss_bytes = 0
+        self.measured = None
+
     def __call__(self, progress, data):
-        process = psutil.Process()
-        rss_bytes = process.memory_info().rss
-        return "%s MB" % (rss_bytes // 1048576)
+        now = time.monotonic()
+        if self.measured is None or now - self.measured >= self.interval:
+            if self.process is None:
+                self.process = psutil.Process()
+            self.rss_bytes = self.process.memory_info().rss
+            self.measured = now
+        return "%s MB" % (self.rss_bytes // 1048576)
 
 
 class Command(BaseCommand):
@@ -77,6 +242,9 @@ It is possible to force the import of files which weren't downloaded using the
 
     logger = logging.getLogger("cities_light")
 
+    # receivers suspended by suspend_derived_fields(), by model class
+    _suspended_receivers = None
+
     def create_parser(self, *args, **kwargs):
         parser = super().create_parser(*args, **kwargs)
         parser.formatter_class = RawTextHelpFormatter
@@ -128,7 +296,11 @@ It is possible to force the import of files which weren't downloaded using the
                 "--hack-translations",
                 action="store_true",
                 default=False,
-                help="Set this if you intend to import translations a lot",
+                help=(
+                    "Set this if you intend to import translations a lot:\n"
+                    "parsed translations are cached in DATA_DIR and imported\n"
+                    "on every run"
+                ),
             ),
         )
         (
@@ -139,6 +311,88 @@ It is possible to force the import of files which weren't downloaded using the
                 help="Do not update slugs",
             ),
         )
+        (
+            parser.add_argument(
+                "--hash-rows",
+                action="store_true",
+                default=False,
+                help=(
+                    "Keep a hash of each imported row in DATA_DIR and skip rows\n"
+                    "which did not change in the source since the last import,\n"
+                    "even if they were changed in the database"
+                ),
+            ),
+        )
+        (
+            parser.add_argument(
+                "--diff",
+                action="store_true",
+                default=False,
+                help=(
+                    "Only import the lines of country, region, subregion and\n"
+                    "city sources which were added or changed since the last\n"
+                    "import with --diff, from a copy of each imported file kept\n"
+                    "in DATA_DIR"
+                ),
+            ),
+        )
+        (
+            parser.add_argument(
+                "--incremental",
+                action="store_true",
+                default=False,
+                help=(
+                    "Only apply the geonames daily modification and deletion\n"
+                    "files published since the last import"
+                ),
+            ),
+        )
+        (
+            parser.add_argument(
+                "--incremental-insert",
+                action="store_true",
+                default=False,
+                help=(
+                    "With --incremental, also insert the modified cities\n"
+                    "which are not in the database yet and pass the\n"
+                    "filters, instead of only updating existing cities"
+                ),
+            ),
+        )
+        (
+            parser.add_argument(
+                "--prune",
+                action="store_true",
+                default=False,
+                help=(
+                    "Delete the rows which are not in the sources anymore,\n"
+                    "for models which sources were all imported"
+                ),
+            ),
+        )
+        (
+            parser.add_argument(
+                "--prune-threshold",
+                type=float,
+                default=0.1,
+                help=(
+                    "Do not prune a model if more than this fraction of its\n"
+                    "rows would be deleted (default: 0.1)"
+                ),
+            ),
+        )
+        (
+            parser.add_argument(
+                "--extract",
+                action="store_true",
+                default=False,
+                help=(
+                    "Extract zip sources into DATA_DIR instead of reading\n"
+                    "them from the archives, again only when an archive\n"
+                    "changes"
+                ),
+            ),
+        )
         (
             parser.add_argument(
                 "--progress",
@@ -147,6 +401,44 @@ It is possible to force the import of files which weren't downloaded using the
                 help="Show progress bar",
             ),
         )
+        (
+            parser.add_argument(
+                "--workers",
+                type=int,
+                default=1,
+                help=(
+                    "Import cities with this many processes, each importing\n"
+                    "the cities of a share of the countries (default: 1)"
+                ),
+            ),
+        )
+        (
+            parser.add_argument(
+                "--batch-size",
+                type=int,
+                default=0,
+                help=(
+                    "Import in chunks of this size with bulk queries, post_save\n"
+                    "signals are not sent in this mode (default: 0, save rows\n"
+                    "one by one)"
+                ),
+            ),
+        )
+        (
+            parser.add_argument(
+                "--engine",
+                choices=sorted(ENGINES),
+                default="orm",
+                help=(
+                    "How chunks are written with --batch-size (default: orm):\n"
+                    "  orm: bulk_create() and bulk_update(), any database\n"
+                    "  copy: COPY into a staging table and merge, PostgreSQL\n"
+                    "  load-data: LOAD DATA LOCAL INFILE into a staging table\n"
+                    "    and merge, MySQL\n"
+                    "  sqlite: executemany() upserts with fast pragmas, SQLite"
+                ),
+            ),
+        )
 
     def progress_init(self):
         """Initialize progress bar."""
@@ -161,17 +453,29 @@ It is possible to force the import of files which weren't downloaded using the
                 progressbar.Bar(),
             ]
 
-    def progress_start(self, max_value):
-        """Start progress bar."""
+    def progress_start(self, max_value, position=None):
+        """
+        Start progress bar, of the values returned by the position function
+        if set, or of the values passed to progress_update().
+        """
         if self.progress_enabled:
             self.progress = progressbar.ProgressBar(
                 max_value=max_value, widgets=self.progress_widgets
-            ).start()
+            )
+            self.progress_position = position
+            self.progress_next = 0
 
     def progress_update(self, value):
-        """Update progress bar."""
+        """Update progress bar, at most every PROGRESS_INTERVAL seconds."""
         if self.progress_enabled:
-            self.progress.update(value)
+            now = time.monotonic()
+            if now < self.progress_next:
+                return
+            self.progress_next = now + PROGRESS_INTERVAL
+
+            if self.progress_position is not None:
+                value = self.progress_position()
+            self.progress.update(min(value, self.progress.max_value))
 
     def progress_finish(self):
         """Finalize progress bar."""
@@ -187,14 +491,45 @@ It is possible to force the import of files which weren't downloaded using the
             os.mkdir(DATA_DIR)
 
         install_file_path = os.path.join(DATA_DIR, "install_datetime")
-        translation_hack_path = os.path.join(DATA_DIR, "translation_hack")
+        translation_cache_path = os.path.join(DATA_DIR, "translation_cache")
 
         self.noinsert = options.get("noinsert", False)
         self.keep_slugs = options.get("keep_slugs", False)
         self.progress_enabled = options.get("progress")
+        self.batch_size = options.get("batch_size") or 0
+        self.hash_rows = options.get("hash_rows", False)
+        self.prune = options.get("prune", False)
+        self.extract = options.get("extract", False)
+        self.incremental_insert = options.get("incremental_insert", False)
+        # geoname ids of the rows of each model found in sources for --prune
+        self._seen_geoname_ids = {}
+        self._imported_sources = set()
+        engine_class = ENGINES[options.get("engine") or "orm"]
+        write_connection = connections[router.db_for_write(City)]
+        error = engine_class.check(write_connection)
+        if error:
+            raise CommandError("--engine=%s %s" % (options["engine"], error))
+        if engine_class is not OrmEngine and not self.batch_size:
+            self.batch_size = DEFAULT_BATCH_SIZE
+        self.engine = engine_class(self.batch_size)
+        self.workers = options.get("workers") or 1
+        if self.workers > 1 and write_connection.vendor == "sqlite":
+            self.logger.warning(
+                "SQLite does not support concurrent writes, importing cities"
+                " with a single process"
+            )
+            self.workers = 1
 
         self.progress_init()
 
+        suspend = (
+            self.suspend_derived_fields if self.batch_size else contextlib.nullcontext
+        )
+        if options.get("incremental", False):
+            with self.engine.session(write_connection), related_cache(), suspend():
+                self.incremental_import(install_file_path)
+            return
+
         sources = list(
             itertools.chain(
                 COUNTRY_SOURCES,
@@ -205,258 +540,1167 @@ It is possible to force the import of files which weren't downloaded using the
             )
         )
 
-        for url in sources:
-            if url in TRANSLATION_SOURCES:
-                # free some memory
-                self._clear_identity_maps()
+        with self.engine.session(write_connection), related_cache(), suspend():
+            for url in sources:
+                if url in TRANSLATION_SOURCES:
+                    # free some memory
+                    self._clear_identity_maps()
 
-            destination_file_name = url.split("/")[-1]
+                destination_file_name = url.split("/")[-1]
 
-            force = options.get("force_all", False)
-            if not force:
-                for f in options["force"]:
-                    if f in destination_file_name or f in url:
-                        force = True
+                force = options.get("force_all", False)
+                if not force:
+                    for f in options["force"]:
+                        if f in destination_file_name or f in url:
+                            force = True
 
-            geonames = Geonames(url, force=force)
-            downloaded = geonames.downloaded
+                geonames = Geonames(url, force=force, extract=self.extract)
+                downloaded = geonames.downloaded
 
-            force_import = options.get("force_import_all", False)
+                force_import = options.get("force_import_all", False)
 
-            if not force_import:
-                for f in options["force_import"]:
-                    if f in destination_file_name or f in url:
-                        force_import = True
+                if not force_import:
+                    for f in options["force_import"]:
+                        if f in destination_file_name or f in url:
+                            force_import = True
 
-            if not os.path.exists(install_file_path):
-                self.logger.info(
-                    "Forced import of %s because data do not seem"
-                    " to have installed successfully yet, note that this is"
-                    " equivalent to --force-import-all.",
-                    destination_file_name,
-                )
-                force_import = True
+                if not os.path.exists(install_file_path):
+                    self.logger.info(
+                        "Forced import of %s because data do not seem"
+                        " to have installed successfully yet, note that this is"
+                        " equivalent to --force-import-all.",
+                        destination_file_name,
+                    )
+                    force_import = True
 
-            if downloaded or force_import:
-                self.logger.info("Importing %s", destination_file_name)
+                if url in TRANSLATION_SOURCES and options.get(
+                    "hack_translations", False
+                ):
+                    translation_cache_tag = self.translation_cache_tag(geonames)
+                    translation_data = read_translation_cache(
+                        translation_cache_path, translation_cache_tag
+                    )
+                    if translation_data is not None:
+                        self.logger.debug(
+                            "Using translation cache: %s", translation_cache_path
+                        )
+                        self.translation_data = translation_data
+                        continue
 
-                if url in TRANSLATION_SOURCES:
-                    if options.get("hack_translations", False):
-                        if os.path.exists(translation_hack_path):
-                            self.logger.debug(
-                                "Using translation parsed data: %s",
-                                translation_hack_path,
+                    self.logger.info(
+                        "Forced import of %s because the translation cache is"
+                        " missing or outdated",
+                        destination_file_name,
+                    )
+                    force_import = True
+
+                if downloaded or force_import:
+                    self.logger.info("Importing %s", destination_file_name)
+
+                    self.stats = collections.Counter()
+
+                    # translations of a geoname are imported all together
+                    diff = options.get("diff", False) and url not in TRANSLATION_SOURCES
+                    if not diff and url not in TRANSLATION_SOURCES:
+                        geonames.forget_imported()
+
+                    if url in CITY_SOURCES and self.workers > 1 and not diff:
+                        self.city_import_parallel(url)
+                    else:
+                        rows = geonames.parse(
+                            line_filter=self.source_line_filter(self._source_model(url))
+                        )
+                        if (
+                            url in TRANSLATION_SOURCES
+                            and not translation_items_pre_import.has_listeners(self)
+                            and not translation_items_pre_import_batch.has_listeners(
+                                self
                             )
-                            continue
+                        ):
+                            # skip other languages before decoding lines
+                            rows = geonames.parse_matching(
+                                IAlternate.language, TRANSLATION_LANGUAGES
+                            )
+                        imported = contextlib.nullcontext()
+                        if diff:
+                            # rows are linked again when their parents change
+                            tag = "parents=%s" % self._parents_checksum(
+                                self._source_model(url)
+                            )
+                            imported = geonames.write_imported(tag)
 
-                i = 0
-                self.progress_start(geonames.num_lines())
+                        with imported as add_imported:
+                            if diff:
+                                rows = self.diff_rows(url, geonames, add_imported, tag)
 
-                for items in geonames.parse():
-                    if url in CITY_SOURCES:
-                        self.city_import(items)
-                    elif url in REGION_SOURCES:
-                        self.region_import(items)
-                    elif url in COUNTRY_SOURCES:
-                        self.country_import(items)
-                    elif url in SUBREGION_SOURCES:
-                        self.subregion_import(items)
-                    elif url in TRANSLATION_SOURCES:
-                        self.translation_parse(items)
+                            self.progress_start(geonames.size(), geonames.tell)
+                            self.import_source(url, rows, imported=add_imported)
+                            self.progress_finish()
 
-                    # prevent memory leaks in DEBUG mode
-                    # https://docs.djangoproject.com/en/1.9/faq/models/
-                    # #how-can-i-see-the-raw-sql-queries-django-is-running
-                    if settings.DEBUG:
-                        reset_queries()
+                    self._imported_sources.add(url)
+                    self.log_stats(destination_file_name)
 
-                    i += 1
-                    self.progress_update(i)
+                    if url in TRANSLATION_SOURCES and options.get(
+                        "hack_translations", False
+                    ):
+                        write_translation_cache(
+                            translation_cache_path,
+                            getattr(self, "translation_data", {}),
+                            translation_cache_tag,
+                        )
 
-                self.progress_finish()
+            self.logger.info("Importing parsed translation in the database")
+            self.translation_import()
 
-                if url in TRANSLATION_SOURCES and options.get(
-                    "hack_translations", False
-                ):
-                    with open(translation_hack_path, "wb+") as f:
-                        pickle.dump(self.translation_data, f)
+            if self.prune:
+                self.prune_import(options.get("prune_threshold"))
+
+        with open(install_file_path, "wb+") as f:
+            pickle.dump(datetime.datetime.now(), f)
+
+    def prune_import(self, threshold):
+        """
+        Delete the rows of each model which were not found in its sources,
+        if they were all imported in this run and at most the threshold
+        fraction of the rows is deleted.
 
-        if options.get("hack_translations", False):
-            if os.path.getsize(translation_hack_path) > 0:
-                with open(translation_hack_path, "rb") as f:
-                    self.translation_data = pickle.load(f)
+        Rows deleted with them by on_delete=CASCADE, such as the cities of a
+        country, are checked against the threshold of their model too.
+        """
+        for model_class, sources in (
+            (City, CITY_SOURCES),
+            (SubRegion, SUBREGION_SOURCES),
+            (Region, REGION_SOURCES),
+            (Country, COUNTRY_SOURCES),
+        ):
+            if not sources or not all(url in self._imported_sources for url in sources):
+                continue
+
+            seen = self._seen_geoname_ids.pop(model_class, GeonameIds())
+            stale = array.array("q")
+            total = 0
+            for geoname_id in (
+                model_class.objects.filter(geoname_id__isnull=False)
+                .values_list("geoname_id", flat=True)
+                .iterator()
+            ):
+                total += 1
+                if geoname_id not in seen:
+                    stale.append(geoname_id)
+
+            if not stale:
+                continue
+
+            if len(stale) > threshold * total:
+                self.logger.warning(
+                    "Not pruning %s: %s of %s rows are not in the sources,"
+                    " more than --prune-threshold=%s",
+                    model_class._meta.verbose_name_plural,
+                    len(stale),
+                    total,
+                    threshold,
+                )
+                continue
+
+            if self._prune_cascades_exceed(model_class, stale, threshold):
+                continue
+
+            for start in range(0, len(stale), DEFAULT_BATCH_SIZE):
+                model_class.objects.filter(
+                    geoname_id__in=stale[start : start + DEFAULT_BATCH_SIZE]
+                ).delete()
+            self.logger.info(
+                "Pruned %s %s which are not in the sources anymore",
+                len(stale),
+                model_class._meta.verbose_name_plural,
+            )
+
+        self._clear_identity_maps()
+
+    def _prune_cascades_exceed(self, model_class, geoname_ids, threshold):
+        """
+        Return True and log a warning if deleting the model_class rows of
+        geoname_ids deletes more than the threshold fraction of the rows of
+        another model by on_delete=CASCADE, ie. the cities of a country.
+        """
+        using = router.db_for_write(model_class)
+        deleted = collections.defaultdict(set)
+        for start in range(0, len(geoname_ids), DEFAULT_BATCH_SIZE):
+            collector = Collector(using=using)
+            collector.collect(
+                model_class.objects.filter(
+                    geoname_id__in=geoname_ids[start : start + DEFAULT_BATCH_SIZE]
+                )
+            )
+            for deleted_class, instances in collector.data.items():
+                deleted[deleted_class].update(instance.pk for instance in instances)
+            for queryset in collector.fast_deletes:
+                deleted[queryset.model].update(
+                    queryset.values_list("pk", flat=True).iterator()
+                )
+
+        deleted.pop(model_class, None)
+        for deleted_class, pks in deleted.items():
+            total = deleted_class.objects.count()
+            if len(pks) > threshold * total:
+                self.logger.warning(
+                    "Not pruning %s: %s of %s %s would be deleted with them,"
+                    " more than --prune-threshold=%s",
+                    model_class._meta.verbose_name_plural,
+                    len(pks),
+                    total,
+                    deleted_class._meta.verbose_name_plural,
+                    threshold,
+                )
+                return True
+        return False
+
+    def _source_model(self, url):
+        """Return the model class of the url source, None for translations."""
+        for sources, model_class in (
+            (COUNTRY_SOURCES, Country),
+            (REGION_SOURCES, Region),
+            (SUBREGION_SOURCES, SubRegion),
+            (CITY_SOURCES, City),
+        ):
+            if url in sources:
+                return model_class
+
+    def source_line_filter(self, model_class, shard=None):
+        """
+        Return the conditions of the built-in filters connected for
+        model_class rows compiled into a Geonames.parse() line predicate, so
+        that most rows they would remove are not even split, or None.
+
+        shard is a (shard, shards) tuple for city workers, the cities of
+        other shards of countries are rejected too.
+        """
+        if model_class is None:
+            return None
+
+        filters = []
+        if INCLUDE_COUNTRIES is not None:
+            countries = frozenset(INCLUDE_COUNTRIES)
+            filters.append(
+                {
+                    Country: filter_non_included_countries_country,
+                    Region: filter_non_included_countries_region,
+                    SubRegion: filter_non_included_countries_subregion,
+                    City: filter_non_included_countries_city,
+                }[model_class],
+            )
+        if model_class is City:
+            filters.append(filter_non_cities)
+            if MIN_CITY_POPULATION is not None:
+                filters.append(filter_small_cities)
+
+        signal = PRE_IMPORT_BATCH_SIGNALS[model_class]
+        conditions = {}
+        for receiver in filters:
+            if not signal.is_connected(receiver):
+                continue
+            if receiver is filter_non_cities:
+                conditions[ICity.featureCode] = frozenset(
+                    INCLUDE_CITY_TYPES
+                ).__contains__
+            elif receiver is filter_small_cities:
+                conditions[ICity.population] = lambda population: (
+                    int(population or 0) >= MIN_CITY_POPULATION
+                )
+            elif model_class is City:
+                conditions[ICity.countryCode] = countries.__contains__
             else:
-                self.logger.debug(
-                    "The translation file that you are trying to load is empty: %s",
-                    translation_hack_path,
+                # country code, or region code prefixed with the country code
+                conditions[0] = lambda code: code.split(".")[0] in countries
+
+        if shard is not None:
+            conditions[ICity.countryCode] = self._shard_condition(
+                *shard, conditions.get(ICity.countryCode)
+            )
+
+        return line_filter(conditions)
+
+    @staticmethod
+    def _shard_condition(shard, shards, condition=None):
+        """
+        Return a condition of the country codes of shard, and of condition
+        if set, computed once per country code.
+        """
+        matches = {}
+
+        def shard_condition(code):
+            try:
+                return matches[code]
+            except KeyError:
+                match = country_shard(code, shards) == shard and (
+                    condition is None or condition(code)
                 )
+                matches[code] = match
+                return match
 
-        self.logger.info("Importing parsed translation in the database")
-        self.translation_import()
+        return shard_condition
 
-        with open(install_file_path, "wb+") as f:
-            pickle.dump(datetime.datetime.now(), f)
+    def diff_rows(self, url, geonames, add_imported, tag):
+        """
+        Yield the rows of the url source which were added or changed since
+        the last import with --diff, count the removed ones and remember the
+        geoname ids of unchanged ones for --prune. All rows are yielded if
+        the copy of the last import has another tag.
+
+        Unchanged rows are passed to add_imported right away, import_source()
+        passes the other rows once they are imported.
+        """
+        model_class = self._source_model(url)
+        geonameid = self._importers()[model_class][2]
+
+        for status, items in geonames.diff(geonameid, tag):
+            if status == "removed":
+                self.stats["removed"] += 1
+            elif status == "unchanged":
+                add_imported(items)
+                if self.prune:
+                    geoname_id = self._geoname_id(items, geonameid)
+                    if geoname_id is not None:
+                        self._seen_geoname_ids.setdefault(
+                            model_class, GeonameIds()
+                        ).add(geoname_id)
+            else:
+                yield items
+
+    def log_stats(self, name):
+        """Log the stats of the import of the name source."""
+        if self.stats:
+            self.logger.info(
+                "Imported %s: %s created, %s updated, %s skipped",
+                name,
+                self.stats["created"],
+                self.stats["updated"],
+                self.stats["skipped"],
+            )
+        if self.stats["removed"]:
+            self.logger.info(
+                "%s rows were removed from %s since the last import",
+                self.stats["removed"],
+                name,
+            )
+
+    def incremental_import(self, install_file_path):
+        """
+        Apply the geonames daily files published since the last applied
+        date, up to the last published one.
+
+        The last applied date is recorded in DATA_DIR/incremental_date, a
+        full import resets it to the day before the install date since the
+        files of a day contain the changes of the previous day.
+        """
+        date_file_path = os.path.join(DATA_DIR, "incremental_date")
+
+        dates = []
+        if os.path.exists(date_file_path):
+            with open(date_file_path) as f:
+                dates.append(datetime.date.fromisoformat(f.read().strip()))
+        if os.path.exists(install_file_path):
+            with open(install_file_path, "rb") as f:
+                install_date = pickle.load(f).date()
+            dates.append(install_date - datetime.timedelta(days=1))
+        if not dates:
+            raise CommandError("--incremental requires a full import first")
+
+        # rows of the daily files are not those of the hashed sources
+        self.hash_rows = False
+
+        date = max(dates)
+        while date < datetime.date.today():
+            date += datetime.timedelta(days=1)
+
+            sources = {}
+            try:
+                for name in INCREMENTAL_SOURCES:
+                    url = "%s%s-%s.txt" % (INCREMENTAL_BASE_URL, name, date)
+                    sources[name] = Geonames(url)
+            except (SourceFileDoesNotExist, URLError) as e:
+                published = self._last_published_date(date)
+                if published is not None:
+                    raise CommandError(
+                        "Geonames updates of %s are not published anymore, but"
+                        " those of %s are: run a full import to catch up"
+                        % (date, published)
+                    )
+                self.logger.info("Geonames updates of %s not found: %s", date, e)
+                break
+
+            self.logger.info("Applying geonames updates of %s", date)
+            self.incremental_apply(**sources)
+
+            # the copies of the city sources kept by --diff are stale now
+            for url in CITY_SOURCES:
+                Geonames(url, download=False).forget_imported()
+
+            for geonames in sources.values():
+                os.remove(geonames.file_path)
+            with open(date_file_path, "w") as f:
+                f.write(date.isoformat())
+
+    def _last_published_date(self, after):
+        """
+        Return the date of the last geonames daily files if they were
+        published after the after date, None otherwise.
+
+        Only today and yesterday are looked for, so this tells a day which
+        geonames does not publish anymore from one which is not published
+        yet.
+        """
+        today = datetime.date.today()
+        for date in (today, today - datetime.timedelta(days=1)):
+            if date <= after:
+                break
+            url = "%smodifications-%s.txt" % (INCREMENTAL_BASE_URL, date)
+            try:
+                geonames = Geonames(url)
+            except (SourceFileDoesNotExist, URLError):
+                continue
+            os.remove(geonames.file_path)
+            return date
+        return None
+
+    def incremental_apply(
+        self,
+        modifications,
+        deletes,
+        alternateNamesModifications,
+        alternateNamesDeletes,
+    ):
+        """
+        Apply geonames daily files: update modified cities, delete deleted
+        cities and apply alternate names changes to translations.
+
+        Modified cities which are not in the database are only inserted with
+        --incremental-insert: daily files cover all the features of
+        geonames, not only those of CITY_SOURCES.
+
+        Countries, regions and subregions are imported from other sources
+        and are left alone.
+        """
+        self.stats = collections.Counter()
+        self.progress_start(modifications.size(), modifications.tell)
+        noinsert = self.noinsert
+        self.noinsert = noinsert or not self.incremental_insert
+        try:
+            self.import_source(
+                modifications.file_path,
+                modifications.parse(line_filter=self.source_line_filter(City)),
+                City,
+            )
+        finally:
+            self.noinsert = noinsert
+        self.progress_finish()
+        self.log_stats(os.path.basename(modifications.file_path))
+
+        geoname_ids = [int(items[0]) for items in deletes.parse()]
+        deleted = 0
+        for start in range(0, len(geoname_ids), DEFAULT_BATCH_SIZE):
+            deleted += (
+                City.objects.filter(
+                    geoname_id__in=geoname_ids[start : start + DEFAULT_BATCH_SIZE]
+                )
+                .delete()[1]
+                .get(City._meta.label, 0)
+            )
+        self._snapshots.pop(City, None)
+        self._geoname_ids.pop(City, None)
+        self.logger.info(
+            "Deleted %s cities from %s",
+            deleted,
+            os.path.basename(deletes.file_path),
+        )
+
+        self._load_translation_geoname_ids(reload=True)
+        added = {}
+        for items in self.filter_rows(
+            translation_items_pre_import_batch, alternateNamesModifications.parse()
+        ):
+            item = self._translation_item(items)
+            if item:
+                model_class, geoname_id, lang, name = item
+                added.setdefault((model_class, geoname_id), {}).setdefault(
+                    lang, []
+                ).append(name)
+
+        removed = {}
+        for items in alternateNamesDeletes.parse():
+            geoname_id = int(items[1])
+            model_class = self._translation_model(geoname_id)
+            if model_class:
+                removed.setdefault((model_class, geoname_id), set()).add(items[2])
+
+        self.translation_delta_import(added, removed)
+
+    def translation_delta_import(self, added, removed):
+        """
+        Add the added {lang: [names]} and remove the removed names from the
+        translations of the rows of their (model class, geoname_id) keys.
+
+        Daily files do not contain the previous version of modified names, so
+        a renamed alternate name is added and its old name is kept.
+        """
+        keys = collections.defaultdict(list)
+        for model_class, geoname_id in sorted(
+            set(added) | set(removed), key=lambda key: key[1]
+        ):
+            keys[model_class].append(geoname_id)
+
+        for model_class, geoname_ids in keys.items():
+            for start in range(0, len(geoname_ids), DEFAULT_BATCH_SIZE):
+                chunk = geoname_ids[start : start + DEFAULT_BATCH_SIZE]
+                current = dict(
+                    model_class.objects.filter(geoname_id__in=chunk).values_list(
+                        "geoname_id", "translations"
+                    )
+                )
+
+                data = {}
+                for geoname_id in chunk:
+                    if geoname_id not in current:
+                        continue
+
+                    names_removed = removed.get((model_class, geoname_id), set())
+                    translations = {}
+                    for lang, names in (current[geoname_id] or {}).items():
+                        names = [n for n in names if n not in names_removed]
+                        if names:
+                            translations[lang] = names
+
+                    for lang, names in added.get((model_class, geoname_id), {}).items():
+                        translated = translations.setdefault(lang, [])
+                        translated += [n for n in names if n not in translated]
+
+                    data[geoname_id] = translations
+
+                self.translation_import_batch(model_class, data)
+
+    def _row_hashes(self, name, model_class, parents=False, **tag):
+        """
+        Return the RowHashes of the name source of model_class rows if
+        --hash-rows is set, None otherwise.
+
+        With parents, the tag includes the checksum of the parent rows.
+        """
+        if not getattr(self, "hash_rows", False):
+            return None
+
+        if parents:
+            tag["parents"] = self._parents_checksum(model_class)
+
+        database = connections[router.db_for_write(model_class)].settings_dict
+        return RowHashes(
+            os.path.join(DATA_DIR, "%s.hashes" % name),
+            dict(
+                model=model_class._meta.label_lower,
+                database=str(database["NAME"]),
+                **tag,
+            ),
+        )
+
+    def _parents_checksum(self, model_class):
+        """
+        Return a checksum of the parent rows which model_class rows are
+        resolved to, so that the hashes of the raw lines are dropped when a
+        country, region or subregion is added, removed or changes its code.
+        """
+        parents = {
+            Country: [],
+            Region: [(Country, "code2")],
+            SubRegion: [(Country, "code2"), (Region, "country_id", "geoname_code")],
+            City: [
+                (Country, "code2"),
+                (Region, "country_id", "geoname_code"),
+                (SubRegion, "region_id", "geoname_code"),
+            ],
+        }[model_class]
+        if not parents:
+            return None
+
+        checksum = hashlib.blake2b(digest_size=8)
+        for parent_class, *fields in parents:
+            for row in (
+                parent_class.objects.order_by("pk")
+                .values_list("pk", *fields)
+                .iterator()
+            ):
+                checksum.update(repr(row).encode("utf-8"))
+            checksum.update(b"\n")
+        return checksum.hexdigest()
+
+    def _get_geoname_ids(self, model_class):
+        """
+        Return the geoname ids of model_class rows, from the snapshot if it
+        is loaded or with a single query on first use.
+        """
+        if model_class in self._snapshots:
+            return self._snapshots[model_class]
+        if model_class not in self._geoname_ids:
+            self._geoname_ids[model_class] = set(
+                model_class.objects.order_by()
+                .values_list("geoname_id", flat=True)
+                .iterator()
+            )
+        return self._geoname_ids[model_class]
+
+    def import_source(self, url, rows, model_class=None, imported=None):
+        """
+        Import rows parsed from the url source, of model_class rows if set,
+        guessed from the url otherwise.
+
+        If set, imported is called with the items of each row which was found
+        or saved in the database, ie. not filtered out nor failed.
+        """
+        if model_class is None:
+            model_class = self._source_model(url)
+
+        if model_class:
+            rows = self.filter_rows(PRE_IMPORT_BATCH_SIGNALS[model_class], rows)
+        elif url in TRANSLATION_SOURCES:
+            rows = self.filter_rows(translation_items_pre_import_batch, rows)
+
+        row_hashes = None
+        seen = None
+        if model_class:
+            _, post_import, geonameid, _ = self._importers()[model_class]
+            row_hashes = self._row_hashes(
+                url.split("/")[-1],
+                model_class,
+                translations=bool(TRANSLATION_SOURCES),
+                parents=True,
+            )
+            if self.prune:
+                seen = self._seen_geoname_ids.setdefault(model_class, GeonameIds())
+        # (geoname_id, hash, items) of rows which are pending a hash or an
+        # imported() call until they are imported
+        pending = []
+        track = model_class and (row_hashes is not None or imported is not None)
+
+        batch = []
+        for i, items in enumerate(rows, 1):
+            if track or seen is not None:
+                geoname_id = self._geoname_id(items, geonameid)
+                if seen is not None and geoname_id is not None:
+                    seen.add(geoname_id)
+
+            if track and geoname_id is not None:
+                digest = None
+                if row_hashes is not None:
+                    digest = row_hash("\t".join(items))
+                    if (
+                        row_hashes.get(geoname_id) == digest
+                        and geoname_id in self._get_geoname_ids(model_class)
+                        and not post_import.has_listeners(self)
+                    ):
+                        row_hashes.add(geoname_id, digest)
+                        if imported is not None:
+                            imported(items)
+                        self.stats["skipped"] += 1
+                        self.progress_update(i)
+                        continue
+                pending.append((geoname_id, digest, items))
+
+            if model_class and self.batch_size:
+                batch.append(items)
+                if len(batch) >= self.batch_size:
+                    self.import_batch(model_class, batch)
+                    batch = []
+            elif model_class is City:
+                self.city_import(items)
+            elif model_class is Region:
+                self.region_import(items)
+            elif model_class is Country:
+                self.country_import(items)
+            elif model_class is SubRegion:
+                self.subregion_import(items)
+            elif url in TRANSLATION_SOURCES:
+                self.translation_parse(items)
+
+            # prevent memory leaks in DEBUG mode
+            # https://docs.djangoproject.com/en/1.9/faq/models/
+            # #how-can-i-see-the-raw-sql-queries-django-is-running
+            if settings.DEBUG:
+                reset_queries()
+
+            if not batch:
+                self._track_imported_rows(row_hashes, imported, pending)
+
+            self.progress_update(i)
+
+        if batch:
+            self.import_batch(model_class, batch)
+            self._track_imported_rows(row_hashes, imported, pending)
+        if row_hashes is not None:
+            row_hashes.save()
+
+    def filter_rows(self, pre_import_batch, rows):
+        """
+        Send pre_import_batch with chunks of rows and yield the rows which
+        its receivers did not remove.
+        """
+        if not pre_import_batch.has_listeners(self):
+            yield from rows
+            return
+
+        rows = iter(rows)
+        size = self.batch_size or DEFAULT_BATCH_SIZE
+        for chunk in iter(lambda: list(itertools.islice(rows, size)), []):
+            pre_import_batch.send(sender=self, rows=chunk)
+            yield from chunk
+
+    @staticmethod
+    def _geoname_id(items, geonameid):
+        """Return the int in the geonameid column of items, or None."""
+        try:
+            return int(items[geonameid])
+        except (IndexError, ValueError):
+            return None
+
+    def _track_imported_rows(self, row_hashes, imported, pending):
+        """
+        Add the hashes of pending rows which were found or saved in the
+        database to row_hashes and pass their items to imported, then clear
+        pending.
+        """
+        for geoname_id, digest, items in pending:
+            if geoname_id in self._imported:
+                if row_hashes is not None:
+                    row_hashes.add(geoname_id, digest)
+                if imported is not None:
+                    imported(items)
+        pending.clear()
+        self._imported.clear()
+
+    def city_import_parallel(self, url):
+        """
+        Import the url city source with a pool of self.workers processes,
+        each importing the cities of a share of the countries with its own
+        database connection and identity maps. With --prune, the geoname
+        ids seen by the workers are merged.
+        """
+        options = dict(
+            noinsert=self.noinsert,
+            keep_slugs=self.keep_slugs,
+            batch_size=self.batch_size,
+            engine=type(self.engine),
+            extract=self.extract,
+            prune=self.prune,
+            suspended_receivers=self._suspended_receivers,
+        )
+
+        # forked processes must not share the parent database connections
+        connections.close_all()
+
+        self.progress_start(self.workers)
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=django.setup
+        ) as executor:
+            futures = [
+                executor.submit(city_import_worker, url, shard, self.workers, options)
+                for shard in range(self.workers)
+            ]
+            for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                stats, seen = future.result()
+                self.stats.update(stats)
+                if seen is not None:
+                    self._seen_geoname_ids.setdefault(City, GeonameIds()).update(seen)
+                self.progress_update(i)
+        self.progress_finish()
 
     def _clear_identity_maps(self):
         """Clear identity maps and free some memory."""
-        if getattr(self, "_country_codes", False):
-            del self._country_codes
-        if getattr(self, "_region_codes", False):
-            del self._region_codes
-        if getattr(self, "_subregion_codes", False):
-            del self._subregion_codes
-        self._country_codes = {}
-        self._region_codes = collections.defaultdict(dict)
-        self._subregion_codes = collections.defaultdict(
-            lambda: collections.defaultdict(dict)
-        )
+        self._country_codes = None
+        self._region_codes = None
+        self._subregion_codes = None
+        self._snapshots = {}
+        self._geoname_ids = {}
+        self._timezones = {}
+        # geoname ids of the rows found or saved in the database
+        self._imported = set()
+        self._slug_planners = {}
+        clear_related_cache()
 
     def _get_country_id(self, country_code2):
         """
-        Simple lazy identity map for code2->country
+        Identity map for code2->country.
+
+        It is loaded with a single query on first use and covers the whole
+        table, so a miss raises Country.DoesNotExist without any query.
         """
-        if country_code2 not in self._country_codes:
-            self._country_codes[country_code2] = Country.objects.get(
-                code2=country_code2
-            ).pk
+        if self._country_codes is None:
+            self._country_codes = dict(
+                Country.objects.order_by().values_list("code2", "pk")
+            )
 
-        return self._country_codes[country_code2]
+        try:
+            return self._country_codes[country_code2]
+        except KeyError:
+            raise Country.DoesNotExist(
+                "Country %s does not exist" % country_code2
+            ) from None
 
     def _get_region_id(self, country_code2, region_id):
         """
-        Simple lazy identity map for (country_code2, region_id)->region
+        Identity map for (country_code2, region_id)->region, see
+        _get_country_id().
         """
         country_id = self._get_country_id(country_code2)
-        if region_id not in self._region_codes[country_id]:
-            self._region_codes[country_id][region_id] = Region.objects.get(
-                country_id=country_id, geoname_code=region_id
-            ).pk
+        if self._region_codes is None:
+            rows = Region.objects.order_by().values_list(
+                "pk", "country_id", "geoname_code"
+            )
+            self._region_codes = {
+                (country, geoname_code): pk for pk, country, geoname_code in rows
+            }
 
-        return self._region_codes[country_id][region_id]
+        try:
+            return self._region_codes[(country_id, region_id)]
+        except KeyError:
+            raise Region.DoesNotExist(
+                "Region %s.%s does not exist" % (country_code2, region_id)
+            ) from None
 
     def _get_subregion_id(self, country_code2, region_id, subregion_id):
         """
-        Simple lazy identity map for (country_code2, region_id,
-        subregion_id)->subregion
+        Identity map for (country_code2, region_id, subregion_id)->subregion,
+        see _get_country_id().
         """
-        country_id = self._get_country_id(country_code2)
-        if region_id not in self._region_codes[country_id]:
-            self._region_codes[country_id][region_id] = Region.objects.get(
-                country_id=country_id, geoname_code=region_id
-            ).pk
-
-        if subregion_id not in self._subregion_codes[country_id][region_id]:
-            self._subregion_codes[country_id][region_id][subregion_id] = (
-                SubRegion.objects.get(
-                    region_id=self._region_codes[country_id][region_id],
-                    geoname_code=subregion_id,
-                ).pk
+        region_pk = self._get_region_id(country_code2, region_id)
+        if self._subregion_codes is None:
+            rows = SubRegion.objects.order_by().values_list(
+                "pk", "region_id", "geoname_code"
             )
-        return self._subregion_codes[country_id][region_id][subregion_id]
+            self._subregion_codes = {
+                (region, geoname_code): pk for pk, region, geoname_code in rows
+            }
 
-    def country_import(self, items):
         try:
-            country_items_pre_import.send(sender=self, items=items)
-        except InvalidItems:
-            return
+            return self._subregion_codes[(region_pk, subregion_id)]
+        except KeyError:
+            raise SubRegion.DoesNotExist(
+                "SubRegion %s.%s.%s does not exist"
+                % (country_code2, region_id, subregion_id)
+            ) from None
+
+    def _snapshot_fields(self, model_class):
+        """
+        Return the attnames of model_class fields which are set from geonames
+        data, in the order of the tuples returned by the *_values() methods.
+        """
+        if model_class is Country:
+            return ("name", "name_ascii", "code2", "code3", "continent", "tld", "phone")
+        if model_class is Region:
+            return ("name", "name_ascii", "country_id", "geoname_code")
+        if model_class is SubRegion:
+            return ("name", "name_ascii", "country_id", "region_id", "geoname_code")
+
+        fields = (
+            "name",
+            "name_ascii",
+            "country_id",
+            "region_id",
+            "subregion_id",
+            "latitude",
+            "longitude",
+            "population",
+            "feature_code",
+            "timezone",
+        )
+        if not TRANSLATION_SOURCES:
+            fields += ("alternate_names",)
+        return fields
+
+    def _get_snapshot(self, model_class):
+        """
+        Return a dict of geoname_id -> tuple of _snapshot_fields() values of
+        all model_class rows, loaded with a single query on first use.
+        """
+        if model_class not in self._snapshots:
+            fields = self._snapshot_fields(model_class)
+            self._snapshots[model_class] = {
+                row[0]: row[1:]
+                for row in model_class.objects.order_by()
+                .values_list("geoname_id", *fields)
+                .iterator()
+            }
+        return self._snapshots[model_class]
+
+    def _remember(self, instance):
+        """Update the snapshot and identity maps after saving instance."""
+        model_class = type(instance)
+        geoname_id = int(instance.geoname_id)
+        self._get_snapshot(model_class)[geoname_id] = tuple(
+            getattr(instance, field) for field in self._snapshot_fields(model_class)
+        )
+        if model_class in self._geoname_ids:
+            self._geoname_ids[model_class].add(geoname_id)
+        self._imported.add(geoname_id)
+
+        # reload the identity map which depends on this table on next use
+        if model_class is Country:
+            self._country_codes = None
+        elif model_class is Region:
+            self._region_codes = None
+        elif model_class is SubRegion:
+            self._subregion_codes = None
+
+    def _unchanged(self, model_class, geoname_id, values, post_import):
+        """
+        Return True if the row can be skipped without any query: it matches
+        the snapshot and no post_import receiver needs an instance.
+        """
+        if self._get_snapshot(model_class).get(
+            geoname_id
+        ) == values and not post_import.has_listeners(self):
+            self._imported.add(geoname_id)
+            self.stats["skipped"] += 1
+            return True
+        return False
+
+    def _prepare(self, model_class, geoname_id, values, items, post_import, instance):
+        """
+        Set values on instance, or a new model_class if None, and send the
+        post_import signal.
+
+        Return a (instance, force_insert, force_update) tuple if the instance
+        should be saved, None otherwise.
+        """
         force_insert = False
         force_update = False
-        if items[ICountry.geonameid] == "":
-            return
-        try:
-            country = Country.objects.get(geoname_id=items[ICountry.geonameid])
+        if instance is not None:
             force_update = True
-        except Country.DoesNotExist:
+        else:
             if self.noinsert:
+                self.stats["skipped"] += 1
                 return
-            country = Country(geoname_id=items[ICountry.geonameid])
+            instance = model_class(geoname_id=geoname_id)
             force_insert = True
 
-        country.name = items[ICountry.name]
-        country.code2 = items[ICountry.code2]
-        country.code3 = items[ICountry.code3]
-        country.continent = items[ICountry.continent]
-        country.tld = items[ICountry.tld][1:]  # strip the leading dot
-        # Strip + prefix for consistency. Note that some countries have several
-        # prefixes i.e. Puerto Rico
-        country.phone = items[ICountry.phone].replace("+", "")
-        # Clear name_ascii to always update it by set_name_ascii() signal
-        country.name_ascii = ""
-
-        if force_update and not self.keep_slugs:
-            country.slug = None
+        save = False
+        for field, value in zip(self._snapshot_fields(model_class), values):
+            if getattr(instance, field) != value:
+                setattr(instance, field, value)
+                save = True
 
-        country_items_post_import.send(sender=self, instance=country, items=items)
+                if field == "name_ascii" and force_update and not self.keep_slugs:
+                    # assign_slugs() derives it from the new name_ascii
+                    instance.slug = None
 
-        self.save(country, force_insert=force_insert, force_update=force_update)
+        post_import.send(sender=self, instance=instance, items=items, save=save)
 
-    def region_import(self, items):
-        try:
-            region_items_pre_import.send(sender=self, items=items)
-        except InvalidItems:
+        if save:
+            return instance, force_insert, force_update
+        if force_update:
+            self._imported.add(geoname_id)
+        self.stats["skipped"] += 1
+
+    def _import_row(self, model_class, geoname_id, values, items, post_import):
+        """Diff one parsed row against the snapshot and save it if needed."""
+        if self._unchanged(model_class, geoname_id, values, post_import):
             return
 
-        force_insert = False
-        force_update = False
-        try:
-            region = Region.objects.get(geoname_id=items[IRegion.geonameid])
-            force_update = True
-        except Region.DoesNotExist:
-            if self.noinsert:
-                return
-            region = Region(geoname_id=items[IRegion.geonameid])
-            force_insert = True
+        instance = None
+        if geoname_id in self._get_snapshot(model_class):
+            instance = model_class.objects.filter(geoname_id=geoname_id).first()
 
-        name = items[IRegion.name]
-        if not items[IRegion.name]:
-            name = items[IRegion.asciiName]
+        prepared = self._prepare(
+            model_class, geoname_id, values, items, post_import, instance
+        )
+        if prepared:
+            instance, force_insert, force_update = prepared
+            self.assign_slugs(model_class, [instance])
+            if self.save(
+                instance, force_insert=force_insert, force_update=force_update
+            ):
+                self._remember(instance)
+                self.stats["created" if force_insert else "updated"] += 1
+
+    def _importers(self):
+        """
+        Return a dict of model class -> (pre_import signal, post_import
+        signal, geonameid column index, values method).
+        """
+        return {
+            Country: (
+                country_items_pre_import,
+                country_items_post_import,
+                ICountry.geonameid,
+                self._country_values,
+            ),
+            Region: (
+                region_items_pre_import,
+                region_items_post_import,
+                IRegion.geonameid,
+                self._region_values,
+            ),
+            SubRegion: (
+                subregion_items_pre_import,
+                subregion_items_post_import,
+                ISubRegion.geonameid,
+                self._subregion_values,
+            ),
+            City: (
+                city_items_pre_import,
+                city_items_post_import,
+                ICity.geonameid,
+                self._city_values,
+            ),
+        }
 
-        code2, geoname_code = items[IRegion.code].split(".")
-        country_id = self._get_country_id(code2)
+    def import_batch(self, model_class, rows):
+        """
+        Import a chunk of model_class rows with a single lookup query for
+        changed rows and bulk queries for writing.
+        """
+        pre_import, post_import, geonameid, get_values = self._importers()[model_class]
+        snapshot = self._get_snapshot(model_class)
+
+        # the last row wins if a geoname_id appears twice, like with save()
+        parsed_rows = {}
+        send_pre_import = bool(pre_import.receivers)
+        for items in rows:
+            if send_pre_import:
+                try:
+                    pre_import.send(sender=self, items=items)
+                except InvalidItems:
+                    continue
 
-        save = False
-        if region.name != name:
-            region.name = name
-            save = True
+            values = get_values(items)
+            if values is None:
+                continue
 
-        if region.country_id != country_id:
-            region.country_id = country_id
-            save = True
+            geoname_id = int(items[geonameid])
+            if self._unchanged(model_class, geoname_id, values, post_import):
+                continue
+            parsed_rows[geoname_id] = (values, items)
 
-        if region.geoname_code != geoname_code:
-            region.geoname_code = geoname_code
-            save = True
+        existing = model_class.objects.in_bulk(
+            [geoname_id for geoname_id in parsed_rows if geoname_id in snapshot],
+            field_name="geoname_id",
+        )
 
-        if region.name_ascii != items[IRegion.asciiName]:
-            region.name_ascii = items[IRegion.asciiName]
-            save = True
+        created = []
+        updated = []
+        for geoname_id, (values, items) in parsed_rows.items():
+            prepared = self._prepare(
+                model_class,
+                geoname_id,
+                values,
+                items,
+                post_import,
+                existing.get(geoname_id),
+            )
+            if not prepared:
+                continue
+            instance, force_insert, force_update = prepared
+            if force_insert:
+                created.append(instance)
+            else:
+                updated.append(instance)
 
-        if force_update and not self.keep_slugs:
-            region.slug = None
+        created_ids = {id(instance) for instance in created}
+        for instance in self.bulk_save(model_class, created, updated):
+            self._remember(instance)
+            self.stats["created" if id(instance) in created_ids else "updated"] += 1
 
-        region_items_post_import.send(sender=self, instance=region, items=items)
+    def country_import(self, items):
+        if country_items_pre_import.receivers:
+            try:
+                country_items_pre_import.send(sender=self, items=items)
+            except InvalidItems:
+                return
 
-        if save:
-            self.save(region, force_insert=force_insert, force_update=force_update)
+        values = self._country_values(items)
+        if values is None:
+            return
 
-    def subregion_import(self, items):
+        self._import_row(
+            Country,
+            int(items[ICountry.geonameid]),
+            values,
+            items,
+            country_items_post_import,
+        )
 
-        try:
-            subregion_items_pre_import.send(sender=self, items=items)
-        except InvalidItems:
+    def _country_values(self, items):
+        """Return the Country values for items, None if it must be skipped."""
+        if items[ICountry.geonameid] == "":
             return
 
-        force_insert = False
-        force_update = False
+        name = items[ICountry.name]
+        return (
+            name,
+            # what set_name_ascii() would set, to compare it with the database
+            to_ascii(name).strip(),
+            items[ICountry.code2],
+            items[ICountry.code3],
+            items[ICountry.continent],
+            items[ICountry.tld][1:],  # strip the leading dot
+            # Strip + prefix for consistency. Note that some countries have
+            # several prefixes i.e. Puerto Rico
+            items[ICountry.phone].replace("+", ""),
+        )
+
+    def region_import(self, items):
+        if region_items_pre_import.receivers:
+            try:
+                region_items_pre_import.send(sender=self, items=items)
+            except InvalidItems:
+                return
+
+        values = self._region_values(items)
+        if values is None:
+            return
+
+        self._import_row(
+            Region,
+            int(items[IRegion.geonameid]),
+            values,
+            items,
+            region_items_post_import,
+        )
+
+    def _region_values(self, items):
+        """Return the Region values for items, None if it must be skipped."""
+        name = items[IRegion.name]
+        if not items[IRegion.name]:
+            name = items[IRegion.asciiName]
+
+        code2, geoname_code = items[IRegion.code].split(".")
         try:
-            subregion = SubRegion.objects.get(geoname_id=items[ISubRegion.geonameid])
-            force_update = True
-        except SubRegion.DoesNotExist:
+            country_id = self._get_country_id(code2)
+        except Country.DoesNotExist:
             if self.noinsert:
                 return
-            subregion = SubRegion(geoname_id=items[ISubRegion.geonameid])
-            force_insert = True
+            else:
+                raise
+
+        return (
+            name,
+            items[IRegion.asciiName] or to_ascii(name).strip(),
+            country_id,
+            geoname_code,
+        )
+
+    def subregion_import(self, items):
+        if subregion_items_pre_import.receivers:
+            try:
+                subregion_items_pre_import.send(sender=self, items=items)
+            except InvalidItems:
+                return
+
+        self._import_row(
+            SubRegion,
+            int(items[ISubRegion.geonameid]),
+            self._subregion_values(items),
+            items,
+            subregion_items_post_import,
+        )
 
+    def _subregion_values(self, items):
         name = items[ISubRegion.name]
         if not items[ISubRegion.name]:
             name = items[ISubRegion.asciiName]
@@ -469,55 +1713,38 @@ It is possible to force the import of files which weren't downloaded using the
 
         try:
             region_id = self._get_region_id(code2, admin1Code)
-        except Region.DoesNotExist:
+        except (Country.DoesNotExist, Region.DoesNotExist):
             region_id = None
 
-        save = False
-        if subregion.name != name:
-            subregion.name = name
-            save = True
-
-        if subregion.country_id != country_id:
-            subregion.country_id = country_id
-            save = True
-
-        if subregion.region_id != region_id:
-            subregion.region_id = region_id
-            save = True
-
-        if subregion.geoname_code != geoname_code:
-            subregion.geoname_code = geoname_code
-            save = True
-
-        if subregion.name_ascii != items[ISubRegion.asciiName]:
-            subregion.name_ascii = items[ISubRegion.asciiName]
-            save = True
-
-        if force_update and not self.keep_slugs:
-            subregion.slug = None
-
-        subregion_items_post_import.send(sender=self, instance=subregion, items=items)
-
-        if save:
-            self.save(subregion, force_insert=force_insert, force_update=force_update)
+        return (
+            name,
+            items[ISubRegion.asciiName] or to_ascii(name).strip(),
+            country_id,
+            region_id,
+            geoname_code,
+        )
 
     def city_import(self, items):
-        try:
-            city_items_pre_import.send(sender=self, items=items)
-        except InvalidItems:
+        if city_items_pre_import.receivers:
+            try:
+                city_items_pre_import.send(sender=self, items=items)
+            except InvalidItems:
+                return
+
+        values = self._city_values(items)
+        if values is None:
             return
 
-        force_insert = False
-        force_update = False
-        try:
-            city = City.objects.get(geoname_id=items[ICity.geonameid])
-            force_update = True
-        except City.DoesNotExist:
-            if self.noinsert:
-                return
-            city = City(geoname_id=items[ICity.geonameid])
-            force_insert = True
+        self._import_row(
+            City,
+            int(items[ICity.geonameid]),
+            values,
+            items,
+            city_items_post_import,
+        )
 
+    def _city_values(self, items):
+        """Return the City values for items, None if it must be skipped."""
         try:
             country_id = self._get_country_id(items[ICity.countryCode])
         except Country.DoesNotExist:
@@ -542,68 +1769,54 @@ It is possible to force the import of files which weren't downloaded using the
         except (SubRegion.DoesNotExist, Region.DoesNotExist):
             subregion_id = None
 
-        save = False
-        if city.country_id != country_id:
-            city.country_id = country_id
-            save = True
-
-        if city.region_id != region_id:
-            city.region_id = region_id
-            save = True
-
-        if city.subregion_id != subregion_id:
-            city.subregion_id = subregion_id
-            save = True
-
-        if city.name != items[ICity.name]:
-            city.name = items[ICity.name]
-            save = True
-
-        if city.name_ascii != items[ICity.asciiName]:
+        values = (
+            items[ICity.name],
             # useful for cities with chinese names
-            city.name_ascii = items[ICity.asciiName]
-            save = True
-
-        if city.latitude != items[ICity.latitude]:
-            city.latitude = items[ICity.latitude]
-            save = True
-
-        if city.longitude != items[ICity.longitude]:
-            city.longitude = items[ICity.longitude]
-            save = True
+            items[ICity.asciiName] or to_ascii(items[ICity.name]).strip(),
+            country_id,
+            region_id,
+            subregion_id,
+            self._decimal(City, "latitude", items[ICity.latitude]),
+            self._decimal(City, "longitude", items[ICity.longitude]),
+            int(items[ICity.population]) if items[ICity.population] else None,
+            items[ICity.featureCode],
+            self._timezone(items[ICity.timezone]),
+        )
+        if not TRANSLATION_SOURCES:
+            values += (items[ICity.alternateNames],)
+        return values
 
-        if city.population != items[ICity.population]:
-            city.population = items[ICity.population]
-            save = True
+    @staticmethod
+    def _decimal(model_class, field_name, value):
+        """
+        Return value as a Decimal rounded like the database would store it
+        in the field_name DecimalField of model_class.
+        """
+        if not value:
+            return None
+        field = model_class._meta.get_field(field_name)
+        return decimal.Decimal(value).quantize(
+            decimal.Decimal(1).scaleb(-field.decimal_places)
+        )
 
-        if city.feature_code != items[ICity.featureCode]:
-            city.feature_code = items[ICity.featureCode]
-            save = True
+    def _timezone(self, value):
+        """Return a valid timezone name or None, validated once per value."""
+        if not value:
+            return None
 
-        if city.timezone != items[ICity.timezone]:
+        if value not in self._timezones:
             try:
-                timezone_validator(items[ICity.timezone])
-                city.timezone = items[ICity.timezone]
+                timezone_validator(value)
+                self._timezones[value] = value
             except ValidationError as e:
-                city.timezone = None
+                self._timezones[value] = None
                 self.logger.warning(e.messages)
-            save = True
-
-        altnames = items[ICity.alternateNames]
-        if not TRANSLATION_SOURCES and city.alternate_names != altnames:
-            city.alternate_names = altnames
-            save = True
-
-        if force_update and not self.keep_slugs:
-            city.slug = None
 
-        city_items_post_import.send(sender=self, instance=city, items=items, save=save)
+        return self._timezones[value]
 
-        if save:
-            self.save(city, force_insert=force_insert, force_update=force_update)
-
-    def translation_parse(self, items):
-        if not hasattr(self, "translation_data"):
+    def _load_translation_geoname_ids(self, reload=False):
+        """Load the geoname ids of the models which have translations."""
+        if reload or not hasattr(self, "country_ids"):
             self.country_ids = set(Country.objects.values_list("geoname_id", flat=True))
             self.region_ids = set(Region.objects.values_list("geoname_id", flat=True))
             self.city_ids = set(City.objects.values_list("geoname_id", flat=True))
@@ -611,12 +1824,41 @@ It is possible to force the import of files which weren't downloaded using the
                 SubRegion.objects.values_list("geoname_id", flat=True)
             )
 
+    def translation_cache_tag(self, geonames):
+        """
+        Return the tag of the translation cache for the geonames source.
+
+        Translations parsed from a source depend on the source file, on
+        TRANSLATION_LANGUAGES and on the rows in the database, which are
+        tagged with a checksum of their geoname ids.
+        """
+        self._load_translation_geoname_ids()
+        return dict(
+            source=source_tag(geonames.file_path),
+            languages=sorted(TRANSLATION_LANGUAGES),
+            geoname_ids={
+                model_class._meta.label_lower: zlib.crc32(
+                    array.array("q", sorted(filter(None, geoname_ids))).tobytes()
+                )
+                for model_class, geoname_ids in (
+                    (Country, self.country_ids),
+                    (Region, self.region_ids),
+                    (City, self.city_ids),
+                    (SubRegion, self.subregion_ids),
+                )
+            },
+        )
+
+    def translation_parse(self, items):
+        if not hasattr(self, "translation_data"):
+            self._load_translation_geoname_ids()
+
             self.translation_data = collections.OrderedDict(
                 (
-                    (Country, {}),
-                    (Region, {}),
-                    (City, {}),
-                    (SubRegion, {}),
+                    (Country, TranslationStore()),
+                    (Region, TranslationStore()),
+                    (City, TranslationStore()),
+                    (SubRegion, TranslationStore()),
                 )
             )
 
@@ -629,10 +1871,32 @@ It is possible to force the import of files which weren't downloaded using the
         ):
             connection.close()
 
-        try:
-            translation_items_pre_import.send(sender=self, items=items)
-        except InvalidItems:
-            return
+        item = self._translation_item(items)
+        if item:
+            model_class, item_geoid, item_lang, item_name = item
+            self.translation_data[model_class].add(item_geoid, item_lang, item_name)
+
+    def _translation_model(self, geoname_id):
+        """Return the model class of the row with geoname_id, or None."""
+        if geoname_id in self.country_ids:
+            return Country
+        elif geoname_id in self.region_ids:
+            return Region
+        elif geoname_id in self.city_ids:
+            return City
+        elif geoname_id in self.subregion_ids:
+            return SubRegion
+
+    def _translation_item(self, items):
+        """
+        Return a (model class, geoname_id, lang, name) tuple for alternate
+        name items, None if they must be skipped.
+        """
+        if translation_items_pre_import.receivers:
+            try:
+                translation_items_pre_import.send(sender=self, items=items)
+            except InvalidItems:
+                return
 
         if len(items) > 5:
             # avoid shortnames, colloquial, and historic
@@ -649,24 +1913,9 @@ It is possible to force the import of files which weren't downloaded using the
         # arg optimisation code kills me !!!
         item_geoid = int(item_geoid)
 
-        if item_geoid in self.country_ids:
-            model_class = Country
-        elif item_geoid in self.region_ids:
-            model_class = Region
-        elif item_geoid in self.city_ids:
-            model_class = City
-        elif item_geoid in self.subregion_ids:
-            model_class = SubRegion
-        else:
-            return
-
-        if item_geoid not in self.translation_data[model_class]:
-            self.translation_data[model_class][item_geoid] = {}
-
-        if item_lang not in self.translation_data[model_class][item_geoid]:
-            self.translation_data[model_class][item_geoid][item_lang] = []
-
-        self.translation_data[model_class][item_geoid][item_lang].append(item_name)
+        model_class = self._translation_model(item_geoid)
+        if model_class:
+            return model_class, item_geoid, item_lang, item_name
 
     def translation_import(self):
         data = getattr(self, "translation_data", None)
@@ -675,51 +1924,131 @@ It is possible to force the import of files which weren't downloaded using the
             return
 
         max = 0
-        for model_class, model_class_data in data.items():
-            max += len(model_class_data.keys())
+        for model_class, store in data.items():
+            max += len(store)
 
         i = 0
         self.progress_start(max)
 
-        for model_class, model_class_data in data.items():
-            for geoname_id, geoname_data in model_class_data.items():
-                try:
-                    model = model_class.objects.get(geoname_id=geoname_id)
-                except model_class.DoesNotExist:
+        batch_size = self.batch_size or DEFAULT_BATCH_SIZE
+        for model_class, store in data.items():
+            row_hashes = self._row_hashes(
+                "translation",
+                model_class,
+                languages=sorted(TRANSLATION_LANGUAGES),
+            )
+            if row_hashes is not None:
+                # translations are hashed with the pk of their row, to be
+                # imported again if the row is deleted and created again
+                pks = dict(
+                    model_class.objects.order_by()
+                    .values_list("geoname_id", "pk")
+                    .iterator()
+                )
+
+            for chunk in store.chunks(batch_size):
+                i += len(chunk)
+
+                if row_hashes is not None:
+                    digests = {}
+                    for geoname_id in list(chunk):
+                        if geoname_id not in pks:
+                            continue
+                        digest = row_hash(
+                            json.dumps([str(pks[geoname_id]), chunk[geoname_id]])
+                        )
+                        digests[geoname_id] = digest
+                        if row_hashes.get(geoname_id) == digest:
+                            del chunk[geoname_id]
+
+                self.translation_import_batch(model_class, chunk)
+
+                if row_hashes is not None:
+                    for geoname_id, digest in digests.items():
+                        row_hashes.add(geoname_id, digest)
+
+                self.progress_update(i)
+
+            if row_hashes is not None:
+                row_hashes.save()
+
+        self.progress_finish()
+
+    def translation_import_batch(self, model_class, data):
+        """
+        Set alternate_names and translations from a chunk of translation data
+        with one query to fetch the model_class rows and one bulk_update()
+        query for the changed rows.
+        """
+        related = [f.name for f in model_class._meta.concrete_fields if f.is_relation]
+        models = model_class.objects.select_related(*related).in_bulk(
+            list(data), field_name="geoname_id"
+        )
+
+        changed = []
+        for geoname_id, geoname_data in data.items():
+            model = models.get(geoname_id)
+            if model is None:
+                continue
+
+            save = False
+            alternate_names = set()
+            for lang, names in geoname_data.items():
+                if lang == "post":
+                    # we might want to save the postal codes somewhere
+                    # here's where it will all start ...
                     continue
 
-                save = False
-                alternate_names = set()
-                for lang, names in geoname_data.items():
-                    if lang == "post":
-                        # we might want to save the postal codes somewhere
-                        # here's where it will all start ...
+                for name in names:
+                    if name == model.name:
                         continue
 
-                    for name in names:
-                        if name == model.name:
-                            continue
+                    alternate_names.add(name)
 
-                        alternate_names.add(name)
+            alternate_names = ";".join(sorted(alternate_names))
+            if model.alternate_names != alternate_names:
+                model.alternate_names = alternate_names
+                save = True
 
-                alternate_names = ";".join(sorted(alternate_names))
-                if model.alternate_names != alternate_names:
-                    model.alternate_names = alternate_names
-                    save = True
+            if model.translations != geoname_data:
+                model.translations = geoname_data
+                save = True
 
-                if model.translations != geoname_data:
-                    model.translations = geoname_data
-                    save = True
+            if save:
+                changed.append(model)
 
-                if save:
-                    model.save(force_update=True)
+        if not changed:
+            return
 
-                i += 1
-                self.progress_update(i)
+        # run pre_save receivers which derive fields from alternate names,
+        # such as City.search_names, and update these fields too
+        using = router.db_for_write(model_class)
+        fields = [f for f in model_class._meta.concrete_fields if not f.primary_key]
+        update_fields = {"alternate_names", "translations"}
+        befores = [[getattr(model, f.attname) for f in fields] for model in changed]
+        with self.suspend_derived_fields():
+            for model in changed:
+                signals.pre_save.send(
+                    sender=model_class,
+                    instance=model,
+                    raw=False,
+                    using=using,
+                    update_fields=None,
+                )
+            self.set_derived_fields(model_class, changed)
+        for model, before in zip(changed, befores):
+            update_fields.update(
+                f.name
+                for f, value in zip(fields, before)
+                if getattr(model, f.attname) != value
+            )
 
-        self.progress_finish()
+        with transaction.atomic(using=using):
+            model_class.objects.bulk_update(changed, sorted(update_fields))
+        clear_related_cache(model_class)
 
     def save(self, model, force_insert=False, force_update=False):
+        """Save model, return False if it failed on an IntegrityError."""
         try:
             with transaction.atomic():
                 self.logger.debug("Saving %s", model.name)
@@ -728,3 +2057,148 @@ It is possible to force the import of files which weren't downloaded using the
             # Regarding %r see the https://code.djangoproject.com/ticket/20572
             # Also related to http://bugs.python.org/issue2517
             self.logger.warning("Saving %s failed: %r", model, e)
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def suspend_derived_fields(self, inherited=None):
+        """
+        Suspend the receivers which set display_name and search_names on
+        pre_save, set_derived_fields() sets them for a whole chunk instead.
+
+        inherited is a dict of model class: receivers which were already
+        disconnected, ie. by the parent of a forked worker, which
+        set_derived_fields() must set too.
+        """
+        if self._suspended_receivers is not None:
+            yield
+            return
+
+        with suspend_derived_fields(Region, SubRegion, City) as suspended:
+            receivers = {
+                model_class: set(model_receivers)
+                for model_class, model_receivers in (inherited or {}).items()
+            }
+            for model_class, model_receivers in suspended.items():
+                receivers.setdefault(model_class, set()).update(model_receivers)
+            self._suspended_receivers = receivers
+            try:
+                yield
+            finally:
+                self._suspended_receivers = None
+
+    def set_derived_fields(self, model_class, instances):
+        """
+        Set the fields of the suspended receivers of model_class on
+        instances.
+
+        Countries and regions which are not cached on the instances are read
+        from the related cache, or fetched with one query each for the chunk
+        if no cache is active, and the names of a
+        (country, region) group are computed once for all its cities.
+        """
+        receivers = (self._suspended_receivers or {}).get(model_class)
+        if not receivers or not instances:
+            return
+
+        names = ["country", "region"] if model_class is City else ["country"]
+        related = [(model_class._meta.get_field(name), {}) for name in names]
+        for instance in instances:
+            cache_related(instance, *names)
+        for field, cache in related:
+            missing = {
+                getattr(instance, field.attname)
+                for instance in instances
+                if getattr(instance, field.attname) is not None
+                and not field.is_cached(instance)
+            }
+            if missing:
+                cache.update(field.related_model.objects.in_bulk(missing))
+
+        groups = {}
+        for instance in instances:
+            for field, cache in related:
+                related_id = getattr(instance, field.attname)
+                if related_id in cache:
+                    setattr(instance, field.name, cache[related_id])
+
+            if set_display_name in receivers:
+                instance.display_name = instance.get_display_name()
+
+            if city_search_names in receivers:
+                key = (instance.country_id, instance.region_id)
+                if key not in groups:
+                    groups[key] = (
+                        get_names(instance.region) if instance.region_id else set(),
+                        get_names(instance.country),
+                    )
+                instance.search_names = get_search_names(
+                    get_names(instance), *groups[key]
+                )
+
+    def assign_slugs(self, model_class, instances):
+        """
+        Set the slugs of instances which are empty or taken in their unique
+        scope, without a query per instance.
+        """
+        planner = self._slug_planners.get(model_class)
+        if planner is None:
+            planner = self._slug_planners[model_class] = SlugPlanner(model_class)
+
+        for instance in instances:
+            planner.assign(instance, keep=self.keep_slugs)
+
+    def bulk_save(self, model_class, created, updated):
+        """
+        Insert created and update updated instances of model_class in bulk,
+        return the list of instances which were saved.
+
+        The pre_save signal and the fields pre_save() hooks are run for each
+        instance first, with slugs assigned in between, so that derived fields
+        such as slug, name_ascii or display_name are the same as with save().
+        If the bulk queries fail on an IntegrityError, instances are saved one
+        by one instead so that only the faulty rows are skipped.
+        """
+        if not created and not updated:
+            return []
+
+        using = router.db_for_write(model_class)
+        fields = [f for f in model_class._meta.concrete_fields if not f.primary_key]
+
+        for instance in created + updated:
+            signals.pre_save.send(
+                sender=model_class,
+                instance=instance,
+                raw=False,
+                using=using,
+                update_fields=None,
+            )
+        self.assign_slugs(model_class, created + updated)
+        for add, instances in ((True, created), (False, updated)):
+            for instance in instances:
+                for field in fields:
+                    setattr(instance, field.attname, field.pre_save(instance, add))
+        self.set_derived_fields(model_class, created + updated)
+
+        # bulk queries do not send post_save to drop changed objects
+        clear_related_cache(model_class)
+        try:
+            with transaction.atomic(using=using):
+                self.engine.write(model_class, created, updated, fields, using)
+        except IntegrityError as e:
+            self.logger.warning(
+                "Bulk saving %s failed, saving one by one: %r",
+                model_class._meta.verbose_name_plural,
+                e,
+            )
+            saved = []
+            for instance in created:
+                instance.pk = None
+                if self.save(instance, force_insert=True):
+                    saved.append(instance)
+            for instance in updated:
+                if self.save(instance, force_update=True):
+                    saved.append(instance)
+            return saved
+
+        return created + updated
@@ -1,13 +1,18 @@
+import contextlib
+import functools
+import warnings
+
 from django.db.models import signals
 from .abstract_models import to_ascii, to_search
-from .settings import INCLUDE_CITY_TYPES, INCLUDE_COUNTRIES
+from .settings import INCLUDE_CITY_TYPES, INCLUDE_COUNTRIES, MIN_CITY_POPULATION
 from .signals import (
-    city_items_pre_import,
-    country_items_pre_import,
-    region_items_pre_import,
-    subregion_items_pre_import,
+    city_items_pre_import_batch,
+    country_items_pre_import_batch,
+    region_items_pre_import_batch,
+    subregion_items_pre_import_batch,
 )
 from .exceptions import InvalidItems
+from .related import cache_related
 
 
 def set_name_ascii(sender, instance=None, **kwargs):
@@ -27,40 +32,33 @@ def set_display_name(sender, instance=None, **kwargs):
     Set instance.display_name to instance.get_display_name(), avoid spawning
     queries during __str__().
     """
+    cache_related(instance, "country", "region")
     instance.display_name = instance.get_display_name()
 
 
 def city_country(sender, instance, **kwargs):
     if instance.region_id and not instance.country_id:
+        cache_related(instance, "region")
         instance.country = instance.region.country
 
 
-def city_search_names(sender, instance, **kwargs):
-    search_names = set()
-
-    country_names = {
-        instance.country.name,
-    }
-    if instance.country.alternate_names:
-        for n in instance.country.alternate_names.split(";"):
-            country_names.add(n)
-
-    city_names = {
+def get_names(instance):
+    """Return the set of the name and alternate names of instance."""
+    names = {
         instance.name,
     }
     if instance.alternate_names:
         for n in instance.alternate_names.split(";"):
-            city_names.add(n)
+            names.add(n)
+    return names
 
-    if instance.region_id:
-        region_names = {
-            instance.region.name,
-        }
-        if instance.region.alternate_names:
-            for n in instance.region.alternate_names.split(";"):
-                region_names.add(n)
-    else:
-        region_names = set()
+
+def get_search_names(city_names, region_names, country_names):
+    """
+    Return the search_names of a city from the sets of names of the city,
+    its region and its country.
+    """
+    search_names = set()
 
     for city_name in city_names:
         for country_name in country_names:
@@ -71,7 +69,44 @@ def city_search_names(sender, instance, **kwargs):
                 name = to_search(city_name + region_name + country_name)
                 search_names.add(name)
 
-    instance.search_names = " ".join(sorted(search_names))
+    return " ".join(sorted(search_names))
+
+
+def city_search_names(sender, instance, **kwargs):
+    cache_related(instance, "country", "region")
+    if instance.region_id:
+        region_names = get_names(instance.region)
+    else:
+        region_names = set()
+
+    instance.search_names = get_search_names(
+        get_names(instance), region_names, get_names(instance.country)
+    )
+
+
+@contextlib.contextmanager
+def suspend_derived_fields(*model_classes):
+    """
+    Disconnect the :py:func:`set_display_name` and
+    :py:func:`city_search_names` receivers of model_classes, and connect them
+    back on exit.
+
+    Yield a dict of model class: set of the receivers which were connected,
+    so that the caller can set these fields itself, in bulk.
+    """
+    suspended = {}
+    for model_class in model_classes:
+        for receiver in (set_display_name, city_search_names):
+            if signals.pre_save.disconnect(receiver, sender=model_class):
+                suspended.setdefault(model_class, set()).add(receiver)
+
+    try:
+        yield suspended
+    finally:
+        for model_class, receivers in suspended.items():
+            for receiver in (set_display_name, city_search_names):
+                if receiver in receivers:
+                    signals.pre_save.connect(receiver, sender=model_class)
 
 
 def connect_default_signals(model_class):
@@ -95,88 +130,133 @@ def connect_default_signals(model_class):
         signals.pre_save.connect(city_search_names, sender=model_class)
 
 
-def filter_non_cities(sender, items, **kwargs):
+def batch_filter(function):
+    """
+    Decorate a built-in filter of rows, so that it still works as a receiver
+    of the per-row ``*_items_pre_import`` signals it used to be connected
+    to. It raises :py:class:`~cities_light.exceptions.InvalidItems` when the
+    filter removes the row, with a DeprecationWarning.
+    """
+
+    @functools.wraps(function)
+    def receiver(sender, rows=None, items=None, **kwargs):
+        if rows is not None:
+            return function(sender, rows, **kwargs)
+
+        warnings.warn(
+            "%s is a receiver of the *_items_pre_import_batch signals, "
+            "connecting it to per-row signals is deprecated" % function.__name__,
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        rows = [items]
+        function(sender, rows, **kwargs)
+        if not rows:
+            raise InvalidItems()
+
+    return receiver
+
+
+@batch_filter
+def filter_non_cities(sender, rows, **kwargs):
     """
     Exclude any **city** which feature code must not be included.
     By default, this receiver is connected to
-    :py:func:`~cities_light.signals.city_items_pre_import`, it raises
-    :py:class:`~cities_light.exceptions.InvalidItems` if the row feature code
-    is not in the :py:data:`~cities_light.settings.INCLUDE_CITY_TYPES` setting.
+    :py:func:`~cities_light.signals.city_items_pre_import_batch`, it removes
+    the rows which feature code is not in the
+    :py:data:`~cities_light.settings.INCLUDE_CITY_TYPES` setting.
+    """
+    rows[:] = [items for items in rows if items[7] in INCLUDE_CITY_TYPES]
+
+
+city_items_pre_import_batch.connect(filter_non_cities)
+
+
+@batch_filter
+def filter_small_cities(sender, rows, **kwargs):
+    """
+    Exclude any **city** which population is lower than the
+    :py:data:`~cities_light.settings.MIN_CITY_POPULATION` setting.
+    This is slot is connected to the
+    :py:func:`~cities_light.signals.city_items_pre_import_batch` signal and
+    does nothing by default.
     """
-    if items[7] not in INCLUDE_CITY_TYPES:
-        raise InvalidItems()
+    if MIN_CITY_POPULATION is None:
+        return
+
+    rows[:] = [items for items in rows if int(items[14] or 0) >= MIN_CITY_POPULATION]
 
 
-city_items_pre_import.connect(filter_non_cities)
+city_items_pre_import_batch.connect(filter_small_cities)
 
 
-def filter_non_included_countries_country(sender, items, **kwargs):
+@batch_filter
+def filter_non_included_countries_country(sender, rows, **kwargs):
     """
     Exclude any **country** which country must not be included.
     This is slot is connected to the
-    :py:func:`~cities_light.signals.country_items_pre_import` signal and does
-    nothing by default.  To enable it, set the
+    :py:func:`~cities_light.signals.country_items_pre_import_batch` signal
+    and does nothing by default.  To enable it, set the
     :py:data:`~cities_light.settings.INCLUDE_COUNTRIES` setting.
     """
     if INCLUDE_COUNTRIES is None:
         return
 
-    if items[0].split(".")[0] not in INCLUDE_COUNTRIES:
-        raise InvalidItems()
+    rows[:] = [items for items in rows if items[0].split(".")[0] in INCLUDE_COUNTRIES]
 
 
-country_items_pre_import.connect(filter_non_included_countries_country)
+country_items_pre_import_batch.connect(filter_non_included_countries_country)
 
 
-def filter_non_included_countries_region(sender, items, **kwargs):
+@batch_filter
+def filter_non_included_countries_region(sender, rows, **kwargs):
     """
     Exclude any **region** which country must not be included.
     This is slot is connected to the
-    :py:func:`~cities_light.signals.region_items_pre_import` signal and does
-    nothing by default.  To enable it, set the
+    :py:func:`~cities_light.signals.region_items_pre_import_batch` signal
+    and does nothing by default.  To enable it, set the
     :py:data:`~cities_light.settings.INCLUDE_COUNTRIES` setting.
     """
     if INCLUDE_COUNTRIES is None:
         return
 
-    if items[0].split(".")[0] not in INCLUDE_COUNTRIES:
-        raise InvalidItems()
+    rows[:] = [items for items in rows if items[0].split(".")[0] in INCLUDE_COUNTRIES]
 
 
-region_items_pre_import.connect(filter_non_included_countries_region)
+region_items_pre_import_batch.connect(filter_non_included_countries_region)
 
 
-def filter_non_included_countries_subregion(sender, items, **kwargs):
+@batch_filter
+def filter_non_included_countries_subregion(sender, rows, **kwargs):
     """
     Exclude any **subregion** which country must not be included.
     This is slot is connected to the
-    :py:func:`~cities_light.signals.subregion_items_pre_import` signal and does
-    nothing by default.  To enable it, set the
+    :py:func:`~cities_light.signals.subregion_items_pre_import_batch` signal
+    and does nothing by default.  To enable it, set the
     :py:data:`~cities_light.settings.INCLUDE_COUNTRIES` setting.
     """
     if INCLUDE_COUNTRIES is None:
         return
 
-    if items[0].split(".")[0] not in INCLUDE_COUNTRIES:
-        raise InvalidItems()
+    rows[:] = [items for items in rows if items[0].split(".")[0] in INCLUDE_COUNTRIES]
 
 
-subregion_items_pre_import.connect(filter_non_included_countries_subregion)
+subregion_items_pre_import_batch.connect(filter_non_included_countries_subregion)
 
 
-def filter_non_included_countries_city(sender, items, **kwargs):
+@batch_filter
+def filter_non_included_countries_city(sender, rows, **kwargs):
     """
     Exclude any **city** which country must not be included.
     This is slot is connected to the
-    :py:func:`~cities_light.signals.city_items_pre_import` signal and does
-    nothing by default.  To enable it, set the
+    :py:func:`~cities_light.signals.city_items_pre_import_batch` signal and
+    does nothing by default.  To enable it, set the
     :py:data:`~cities_light.settings.INCLUDE_COUNTRIES` setting.
     """
     if INCLUDE_COUNTRIES is None:
         return
 
-    if items[8].split(".")[0] not in INCLUDE_COUNTRIES:
-        raise InvalidItems()
+    rows[:] = [items for items in rows if items[8].split(".")[0] in INCLUDE_COUNTRIES]
 
 
-city_items_pre_import.connect(filter_non_included_countries_city)
+city_items_pre_import_batch.connect(filter_non_included_countries_city)
@@ -0,0 +1,126 @@
+"""
+Import-scoped cache of the countries and regions which receivers read to
+derive fields such as display_name and search_names, so that saving a city
+does not query its region and country again.
+
+The cities_light command activates it for the whole import, custom
+importers can do the same::
+
+    from cities_light.related import related_cache
+
+    with related_cache():
+        for city in cities:
+            city.save()
+"""
+
+import contextlib
+import contextvars
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import signals
+
+__all__ = [
+    "RelatedCache",
+    "related_cache",
+    "cache_related",
+    "clear_related_cache",
+]
+
+_active = contextvars.ContextVar("cities_light_related_cache", default=None)
+
+
+class RelatedCache:
+    """
+    Objects by model class and pk.
+
+    The table of a model is loaded with a single query the first time one
+    of its objects is requested, objects created afterwards are fetched one
+    by one.
+    """
+
+    def __init__(self):
+        self._objects = {}
+
+    def get(self, model_class, pk):
+        """Return the model_class object of pk, or None."""
+        objects = self._objects.get(model_class)
+        if objects is None:
+            objects = self._objects[model_class] = (
+                model_class.objects.order_by().in_bulk()
+            )
+
+        if pk not in objects:
+            objects[pk] = model_class.objects.filter(pk=pk).first()
+        return objects[pk]
+
+    def discard(self, model_class, pk):
+        """Forget the model_class object of pk."""
+        self._objects.get(model_class, {}).pop(pk, None)
+
+    def clear(self, model_class=None):
+        """Forget the objects of model_class, or of all models."""
+        if model_class is None:
+            self._objects.clear()
+        else:
+            self._objects.pop(model_class, None)
+
+    def _changed(self, sender, instance, **kwargs):
+        self.discard(sender, instance.pk)
+
+
+@contextlib.contextmanager
+def related_cache():
+    """
+    Context manager activating a :py:class:`RelatedCache` for
+    :py:func:`cache_related`, yield the cache.
+
+    Objects saved or deleted one by one are dropped from the cache. Objects
+    changed by bulk or raw queries are not, call
+    :py:func:`clear_related_cache` after such changes.
+    """
+    cache = _active.get()
+    if cache is not None:
+        yield cache
+        return
+
+    cache = RelatedCache()
+    token = _active.set(cache)
+    signals.post_save.connect(cache._changed, weak=False)
+    signals.post_delete.connect(cache._changed, weak=False)
+    try:
+        yield cache
+    finally:
+        signals.post_save.disconnect(cache._changed)
+        signals.post_delete.disconnect(cache._changed)
+        _active.reset(token)
+
+
+def cache_related(instance, *names):
+    """
+    Set the names foreign keys of instance from the active cache, unless
+    they are already cached on instance or no cache is active. Names which
+    are not fields of instance are ignored.
+    """
+    cache = _active.get()
+    if cache is None:
+        return
+
+    for name in names:
+        try:
+            field = instance._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        related_id = getattr(instance, field.attname)
+        if related_id is None or field.is_cached(instance):
+            continue
+
+        related = cache.get(field.related_model, related_id)
+        if related is not None:
+            setattr(instance, name, related)
+
+
+def clear_related_cache(model_class=None):
+    """Forget the objects of model_class, or of all models, if active."""
+    cache = _active.get()
+    if cache is not None:
+        cache.clear(model_class)
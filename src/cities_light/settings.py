@@ -36,6 +36,13 @@ because it's probably project specific.
             'PPLF', 'PPLG', 'PPLL', 'PPLR', 'PPLS', 'STLMT',
         ]
 
+.. py:data:: MIN_CITY_POPULATION
+
+    Minimum population of the cities to include. It's None by default which
+    includes all cities of the sources, even those without population::
+
+        CITIES_LIGHT_MIN_CITY_POPULATION = 1000
+
 .. py:data:: COUNTRY_SOURCES
 
     A list of urls to download country info from. Default is countryInfo.txt
@@ -76,6 +83,13 @@ because it's probably project specific.
    with a slash. Default is ``file://DATA_DIR/fixtures/``. Overridable in
    ``settings.CITIES_LIGHT_FIXTURES_BASE_URL``.
 
+.. py:data:: INCREMENTAL_BASE_URL
+
+   Base URL to download the daily modification and deletion files applied
+   by ``cities_light --incremental`` from. Should end with a slash. Default
+   is the geonames download server. Overridable in
+   ``settings.CITIES_LIGHT_INCREMENTAL_BASE_URL``.
+
 .. py:data:: DATA_DIR
 
     Absolute path to download and extract data into. Default is
@@ -112,6 +126,7 @@ from django.conf import settings
 
 __all__ = [
     "FIXTURES_BASE_URL",
+    "INCREMENTAL_BASE_URL",
     "COUNTRY_SOURCES",
     "REGION_SOURCES",
     "SUBREGION_SOURCES",
@@ -123,6 +138,7 @@ __all__ = [
     "INDEX_SEARCH_NAMES",
     "INCLUDE_COUNTRIES",
     "INCLUDE_CITY_TYPES",
+    "MIN_CITY_POPULATION",
     "DEFAULT_APP_NAME",
     "CITIES_LIGHT_APP_NAME",
     "ICountry",
@@ -200,6 +216,8 @@ INCLUDE_CITY_TYPES = getattr(
     ],
 )
 
+MIN_CITY_POPULATION = getattr(settings, "CITIES_LIGHT_MIN_CITY_POPULATION", None)
+
 # MySQL doesn't support indexing TextFields
 INDEX_SEARCH_NAMES = getattr(settings, "CITIES_LIGHT_INDEX_SEARCH_NAMES", None)
 if INDEX_SEARCH_NAMES is None:
@@ -220,6 +238,12 @@ FIXTURES_BASE_URL = getattr(
     "file://{0}".format(os.path.join(DATA_DIR, "fixtures/")),
 )
 
+INCREMENTAL_BASE_URL = getattr(
+    settings,
+    "CITIES_LIGHT_INCREMENTAL_BASE_URL",
+    "http://download.geonames.org/export/dump/",
+)
+
 
 class ICountry:
     """
@@ -37,6 +37,60 @@ Signals for this application.
 
     Note: Be careful because of long runtime; it will be called VERY often.
 
+.. py:data:: city_items_pre_import_batch
+
+    Emited by the cities_light command with chunks of the rows parsed in the
+    data file, before city_items_pre_import is sent for each of them.
+    Receivers skip rows by removing them from the ``rows`` list, which is
+    much faster than raising InvalidItems for each row. The same example
+    as above::
+
+        import cities_light
+
+        def filter_city_import(sender, rows, **kwargs):
+            rows[:] = [items for items in rows if items[8] in ('FR', 'US', 'BE')]
+
+        cities_light.signals.city_items_pre_import_batch.connect(
+            filter_city_import
+        )
+
+    Note: the built-in filters of :py:mod:`cities_light.receivers` are
+    connected to the batch signals, and the command does not send
+    city_items_pre_import at all when it has no receiver. The command also
+    applies the conditions of the connected built-in filters to the raw
+    lines of the sources, before they are parsed.
+
+    Before, the built-in filters were connected to the per-row signals and
+    got ``items`` instead of ``rows``. They still work when connected to a
+    per-row signal, with a DeprecationWarning, but disconnecting them from
+    a per-row signal does nothing anymore. To migrate, replace for
+    example::
+
+        city_items_pre_import.disconnect(filter_non_cities)
+
+    with::
+
+        city_items_pre_import_batch.disconnect(filter_non_cities)
+
+.. py:data:: region_items_pre_import_batch
+
+    Same as :py:data:`~cities_light.signals.city_items_pre_import_batch`.
+
+.. py:data:: subregion_items_pre_import_batch
+
+    Same as :py:data:`~cities_light.signals.city_items_pre_import_batch`.
+
+.. py:data:: country_items_pre_import_batch
+
+    Same as :py:data:`~cities_light.signals.city_items_pre_import_batch`.
+
+.. py:data:: translation_items_pre_import_batch
+
+    Same as :py:data:`~cities_light.signals.city_items_pre_import_batch`,
+    for alternate names. While it has receivers, alternate names in languages
+    which are not in TRANSLATION_LANGUAGES are not skipped before they are
+    sent.
+
 .. py:data:: city_items_post_import
 
     Emited by city_import() in the cities_light command for each row parsed in
@@ -63,6 +117,8 @@ Signals for this application.
     :py:data:`cities_light.signals.city_items_post_import`.
 """
 
+import weakref
+
 import django.dispatch
 
 __all__ = [
@@ -75,6 +131,11 @@ __all__ = [
     "city_items_pre_import",
     "city_items_post_import",
     "translation_items_pre_import",
+    "country_items_pre_import_batch",
+    "region_items_pre_import_batch",
+    "subregion_items_pre_import_batch",
+    "city_items_pre_import_batch",
+    "translation_items_pre_import_batch",
 ]
 
 # providing_args=['items'] for signals below
@@ -84,6 +145,45 @@ region_items_pre_import = django.dispatch.Signal()
 country_items_pre_import = django.dispatch.Signal()
 translation_items_pre_import = django.dispatch.Signal()
 
+
+class BatchSignal(django.dispatch.Signal):
+    """
+    Signal which tells whether a function is connected to it, so that the
+    cities_light command applies the conditions of the built-in filters
+    which are connected only.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._connected = weakref.WeakSet()
+        self._dispatch_uids = {}
+
+    def connect(self, receiver, sender=None, weak=True, dispatch_uid=None):
+        super().connect(receiver, sender, weak, dispatch_uid)
+        self._connected.add(receiver)
+        if dispatch_uid is not None:
+            self._dispatch_uids[dispatch_uid] = receiver
+
+    def disconnect(self, receiver=None, sender=None, dispatch_uid=None):
+        disconnected = super().disconnect(receiver, sender, dispatch_uid)
+        if dispatch_uid is not None:
+            receiver = self._dispatch_uids.pop(dispatch_uid, receiver)
+        if disconnected:
+            self._connected.discard(receiver)
+        return disconnected
+
+    def is_connected(self, receiver):
+        """Return True if receiver is connected, for any sender."""
+        return receiver in self._connected
+
+
+# providing_args=['rows'] for signals below
+city_items_pre_import_batch = BatchSignal()
+subregion_items_pre_import_batch = BatchSignal()
+region_items_pre_import_batch = BatchSignal()
+country_items_pre_import_batch = BatchSignal()
+translation_items_pre_import_batch = BatchSignal()
+
 # providing_args=['instance', 'items'] for all signals below
 city_items_post_import = django.dispatch.Signal()
 subregion_items_post_import = django.dispatch.Signal()
@@ -0,0 +1,112 @@
+"""
+In-memory slug assignment for the cities_light command.
+
+Slugs are not unique by themselves, but unique_together constraints such as
+Region (country, slug) make saving a row fail if its slug is already taken
+in its scope.
+"""
+
+from autoslug.utils import crop_slug, get_prepopulated_value
+
+__all__ = ["SlugPlanner", "slug_scope"]
+
+
+def slug_scope(model_class):
+    """
+    Return the attnames of the fields which slug is unique with for
+    model_class, or None if slugs are not unique.
+    """
+    for fields in model_class._meta.unique_together:
+        if "slug" in fields:
+            return tuple(
+                model_class._meta.get_field(name).attname
+                for name in fields
+                if name != "slug"
+            )
+
+
+class SlugPlanner:
+    """
+    Slugs of the rows of model_class by scope, loaded with a single query.
+
+    :py:meth:`assign` resolves collisions in memory by suffixing slugs with
+    -2, -3... in the order rows are assigned, like
+    ``AutoSlugField(unique_with=...)`` does with a query per candidate.
+
+    Like database constraints, rows with a NULL scope field never collide.
+    """
+
+    def __init__(self, model_class):
+        self.field = model_class._meta.get_field("slug")
+        self.scope = slug_scope(model_class)
+        # (scope values, slug): geoname_id of the row which has it
+        self._owners = {}
+        # geoname_id: (scope values, slug)
+        self._slugs = {}
+
+        if self.scope is None:
+            return
+
+        rows = (
+            model_class.objects.order_by()
+            .values_list("geoname_id", "slug", *self.scope)
+            .iterator()
+        )
+        for geoname_id, slug, *scope in rows:
+            self._register(tuple(scope), slug, geoname_id)
+
+    def slugify(self, instance):
+        """Return the slug AutoSlugField would populate instance with."""
+        value = get_prepopulated_value(self.field, instance)
+        slug = self.field.slugify(value) if value else None
+        if not slug:
+            slug = instance._meta.model_name
+        return self.field.slugify(crop_slug(self.field, slug))
+
+    def assign(self, instance, keep=False):
+        """
+        Set the slug of instance if it is empty, or if it is taken in its
+        scope by another row and keep is False.
+        """
+        if self.scope is None:
+            if not instance.slug:
+                instance.slug = self.slugify(instance)
+            return
+
+        scope = tuple(getattr(instance, attname) for attname in self.scope)
+        geoname_id = instance.geoname_id
+        slug = instance.slug
+        if not slug:
+            slug = self._unique(scope, self.slugify(instance), geoname_id)
+        elif not keep and not self._available(scope, slug, geoname_id):
+            slug = self._unique(scope, slug, geoname_id)
+
+        instance.slug = slug
+        self._register(scope, slug, geoname_id)
+
+    def _available(self, scope, slug, geoname_id):
+        if None in scope:
+            return True
+        owner = self._owners.get((scope, slug), geoname_id)
+        return owner == geoname_id
+
+    def _unique(self, scope, slug, geoname_id):
+        original = slug = crop_slug(self.field, slug)
+        index = 1
+        while not self._available(scope, slug, geoname_id):
+            index += 1
+            tail = "%s%d" % (self.field.index_sep, index)
+            slug = original[: self.field.max_length - len(tail)] + tail
+        return slug
+
+    def _register(self, scope, slug, geoname_id):
+        previous = self._slugs.get(geoname_id)
+        if previous == (scope, slug):
+            return
+        if previous is not None and self._owners.get(previous) == geoname_id:
+            del self._owners[previous]
+
+        if geoname_id is not None:
+            self._slugs[geoname_id] = (scope, slug)
+        if None not in scope:
+            self._owners.setdefault((scope, slug), geoname_id)
@@ -1,5 +1,6 @@
 """Downloader class tests."""
 
+import os
 import tempfile
 import time
 from unittest import mock
@@ -9,7 +10,7 @@ from urllib.error import HTTPError, URLError
 from django import test
 
 from cities_light.downloader import Downloader
-from cities_light.exceptions import SourceFileDoesNotExist
+from cities_light.exceptions import IncompleteDownload, SourceFileDoesNotExist
 
 
 class TestDownloader(test.TransactionTestCase):
@@ -195,22 +196,54 @@ class TestDownloader(test.TransactionTestCase):
         m_need.return_value = True
         downloader = Downloader()
         source = "file:///b.txt"
-        destination = "/tmp/a.txt"
 
-        tmpfile = tempfile.SpooledTemporaryFile(max_size=1024000, mode="wb")
-        tmpfile.write(b"source content")
-        tmpfile.seek(0)
+        m_response = mock.MagicMock()
+        m_response.__enter__.return_value = m_response
+        m_response.headers = {"content-length": "14"}
+        m_response.read.side_effect = [b"source ", b"content", b""]
 
-        mock_open = mock.mock_open()
-        with (
-            mock.patch("cities_light.downloader.urlopen", return_value=tmpfile),
-            mock.patch("cities_light.downloader.open", mock_open),
-        ):
-            # The downloader.needs_downloading will return true and last three
-            # lines of downloader.download will copy the source to destination
-            self.assertTrue(downloader.download(source, destination, False))
-            handle = mock_open()
-            handle.write.assert_called_once_with(b"source content")
+        with tempfile.TemporaryDirectory() as directory:
+            destination = os.path.join(directory, "a.txt")
+            with mock.patch("cities_light.downloader.urlopen", return_value=m_response):
+                self.assertTrue(downloader.download(source, destination, False))
+            m_response.read.assert_called_with(Downloader.chunk_size)
+            with open(destination, "rb") as f:
+                self.assertEqual(f.read(), b"source content")
+            self.assertEqual(os.listdir(directory), ["a.txt"])
+
+    @mock.patch.object(Downloader, "needs_downloading")
+    @mock.patch.object(Downloader, "source_matches_destination")
+    def test_interrupted_download(self, m_check, m_need):
+        """Interrupted downloads leave the destination untouched."""
+        m_check.return_value = False
+        m_need.return_value = True
+        downloader = Downloader()
+
+        m_response = mock.MagicMock()
+        m_response.__enter__.return_value = m_response
+        m_response.headers = {"content-length": "14"}
+
+        with tempfile.TemporaryDirectory() as directory:
+            destination = os.path.join(directory, "a.txt")
+            with open(destination, "wb") as f:
+                f.write(b"old content")
+
+            for chunks in (
+                [b"source ", URLError("connection reset")],
+                [b"source ", b""],
+            ):
+                m_response.read.side_effect = chunks
+                with (
+                    mock.patch(
+                        "cities_light.downloader.urlopen", return_value=m_response
+                    ),
+                    self.assertRaises((URLError, IncompleteDownload)),
+                ):
+                    downloader.download("http://example.com/a.txt", destination)
+
+                with open(destination, "rb") as f:
+                    self.assertEqual(f.read(), b"old content")
+                self.assertEqual(os.listdir(directory), ["a.txt"])
 
     def test_not_download(self):
         """Tests actual not download."""
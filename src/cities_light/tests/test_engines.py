@@ -0,0 +1,128 @@
+"""Tests for the import engines."""
+
+import logging
+import time
+import unittest
+
+from dbdiff.fixture import Fixture
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TransactionTestCase
+
+from .base import TestImportBase, FixtureDir
+from ..engines import ENGINES, LoadDataEngine, SqliteEngine
+from ..loading import get_cities_model
+
+
+class TestEngines(TestImportBase):
+    """Compare engines on the update fixtures."""
+
+    logger = logging.getLogger("cities_light")
+
+    def import_update(self, engine):
+        """Import initial then updated data with engine, return the duration."""
+        fixture_dir = FixtureDir("update")
+        start = time.perf_counter()
+
+        self.import_data(
+            fixture_dir,
+            "initial_country",
+            "initial_region",
+            "initial_subregion",
+            "initial_city",
+            "initial_translations",
+            engine=engine,
+        )
+
+        self.import_data(
+            fixture_dir,
+            "update_country",
+            "update_region",
+            "update_subregion",
+            "update_city",
+            "update_translations",
+            engine=engine,
+        )
+
+        return time.perf_counter() - start
+
+    def test_engines(self):
+        """Test engines supported by the database give the same results."""
+        for name, engine_class in sorted(ENGINES.items()):
+            if engine_class.check(connection):
+                continue
+
+            with self.subTest(engine=name):
+                get_cities_model("Country").objects.all().delete()
+                duration = self.import_update(name)
+                Fixture(
+                    FixtureDir("update").get_file_path("update_fields.json"),
+                    ignore_pk=True,
+                ).assertNoDiff()
+                self.logger.info("%s engine: %.3fs", name, duration)
+
+    def test_engines_check(self):
+        """Test engines which cannot be used are refused."""
+        for name, engine_class in sorted(ENGINES.items()):
+            if not engine_class.check(connection):
+                continue
+
+            with self.subTest(engine=name):
+                with self.assertRaises(CommandError):
+                    self.import_update(name)
+
+
+@unittest.skipUnless(connection.vendor == "mysql", "requires MySQL")
+class TestLoadDataEngine(TestImportBase):
+    """MySQL LOAD DATA engine tests."""
+
+    def setUp(self):
+        error = LoadDataEngine.check(connection)
+        if error:
+            self.skipTest(error)
+
+    def test_unique_collision(self):
+        """Test rows are merged by geoname_id only, not by any unique key."""
+        fixture_dir = FixtureDir("update")
+        self.import_data(
+            fixture_dir, "add_country", "add_region", [], [], [], engine="load-data"
+        )
+        self.import_data(
+            fixture_dir,
+            "add_country",
+            "collision_region",
+            [],
+            [],
+            [],
+            engine="load-data",
+        )
+
+        Region = get_cities_model("Region")
+        self.assertEqual(
+            Region.objects.get(name="Kemerovo", country__code2="RU").geoname_id,
+            1503900,
+        )
+        self.assertFalse(Region.objects.filter(geoname_id=9999001).exists())
+        self.assertTrue(Region.objects.filter(geoname_id=2634895).exists())
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "requires SQLite")
+class TestSqliteEngine(TransactionTestCase):
+    """SQLite engine tests."""
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA %s" % name)
+            return cursor.fetchone()[0]
+
+    def test_session_pragmas(self):
+        """Test pragmas are tuned during the import only."""
+        synchronous = self.pragma("synchronous")
+        cache_size = self.pragma("cache_size")
+
+        with SqliteEngine(100).session(connection):
+            self.assertEqual(self.pragma("synchronous"), 0)
+            self.assertEqual(self.pragma("cache_size"), -65536)
+
+        self.assertEqual(self.pragma("synchronous"), synchronous)
+        self.assertEqual(self.pragma("cache_size"), cache_size)
@@ -1,9 +1,34 @@
+import contextlib
 import glob
+import multiprocessing
 import os
+import unittest
+from unittest import mock
 
+from django.db import connection
+from django.db.models import signals
+from django.test import TransactionTestCase
 from dbdiff.fixture import Fixture
+from cities_light.management.commands.cities_light import (
+    Command,
+    city_import_worker,
+    country_shard,
+)
 from .base import TestImportBase, FixtureDir
-from ..settings import DATA_DIR
+from ..engines import OrmEngine
+from ..exceptions import InvalidItems
+from ..geonames import Geonames, line_filter
+from ..loading import get_cities_models
+from ..receivers import (
+    city_search_names,
+    filter_non_cities,
+    get_names,
+    get_search_names,
+    set_display_name,
+    suspend_derived_fields,
+)
+from ..settings import DATA_DIR, IAlternate, ICity
+from ..signals import city_items_pre_import, city_items_pre_import_batch
 
 
 class TestImport(TestImportBase):
@@ -24,6 +49,60 @@ class TestImport(TestImportBase):
             fixture_dir.get_file_path("angouleme.json"), ignore_pk=True
         ).assertNoDiff()
 
+    def test_single_city_batch(self):
+        """Load single city with bulk queries."""
+        fixture_dir = FixtureDir("import")
+        self.import_data(
+            fixture_dir,
+            "angouleme_country",
+            "angouleme_region",
+            "angouleme_subregion",
+            "angouleme_city",
+            "angouleme_translations",
+            batch_size=2,
+        )
+        Fixture(
+            fixture_dir.get_file_path("angouleme.json"), ignore_pk=True
+        ).assertNoDiff()
+
+    def test_bulk_save_collision(self):
+        """Other rows of a chunk are saved when one of them collides."""
+        fixture_dir = FixtureDir("update")
+        self.import_data(fixture_dir, "add_country", "add_region", [], [], [])
+        # RU.30 has the name of RU.29 which is in the same chunk
+        with self.assertLogs("cities_light", "WARNING") as logs:
+            self.import_data(
+                fixture_dir,
+                "add_country",
+                "collision_region",
+                [],
+                [],
+                [],
+                batch_size=10,
+            )
+        self.assertTrue(any("saving one by one" in output for output in logs.output))
+
+        Region = get_cities_models()[1]
+        self.assertEqual(
+            Region.objects.get(name="Kemerovo", country__code2="RU").geoname_id,
+            1503900,
+        )
+        self.assertFalse(Region.objects.filter(geoname_id=9999001).exists())
+        self.assertTrue(Region.objects.filter(geoname_id=2634895).exists())
+
+    def test_suspend_derived_fields(self):
+        """Derived field receivers are suspended and connected back."""
+        Country, Region, SubRegion, City = get_cities_models()
+        with suspend_derived_fields(Region, City) as suspended:
+            self.assertEqual(suspended[Region], {set_display_name})
+            self.assertEqual(suspended[City], {set_display_name, city_search_names})
+            self.assertFalse(
+                signals.pre_save.disconnect(city_search_names, sender=City)
+            )
+
+        self.assertTrue(signals.pre_save.disconnect(city_search_names, sender=City))
+        signals.pre_save.connect(city_search_names, sender=City)
+
     def test_single_city_zip(self):
         """Load single city."""
         filelist = glob.glob(os.path.join(DATA_DIR, "angouleme_*.txt"))
@@ -44,6 +123,44 @@ class TestImport(TestImportBase):
             FixtureDir("import").get_file_path("angouleme.json"), ignore_pk=True
         ).assertNoDiff()
 
+    def test_zip_member(self):
+        """Zip sources are read from the archive, or extracted when it changes."""
+        url = "file://%s.zip" % FixtureDir("import_zip").get_file_path("angouleme_city")
+        path = os.path.join(DATA_DIR, "angouleme_city")
+        for suffix in (".zip", ".zip.imported", ".txt", ".txt.extracted"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+            self.addCleanup(lambda p: os.path.exists(p) and os.remove(p), path + suffix)
+
+        geonames = Geonames(url)
+        self.assertEqual(geonames.file_path, path + ".zip")
+        self.assertFalse(os.path.exists(path + ".txt"))
+        rows = list(geonames.parse())
+        self.assertEqual(rows[0][ICity.name], "Angoulême")
+        self.assertEqual(geonames.tell(), geonames.size())
+
+        # the copy kept for --diff is an archive too
+        with geonames.write_imported() as add_imported:
+            add_imported(rows[0])
+        self.assertEqual(
+            [status for status, items in geonames.diff(ICity.geonameid)],
+            ["unchanged"] + ["added"] * (len(rows) - 1),
+        )
+        geonames.forget_imported()
+        self.assertFalse(os.path.exists(geonames.imported_path))
+
+        geonames = Geonames(url, download=False, extract=True)
+        self.assertEqual(geonames.file_path, path + ".txt")
+        self.assertEqual(list(geonames.parse()), rows)
+
+        with mock.patch("cities_light.geonames.shutil.copyfileobj") as copy:
+            Geonames(url, download=False, extract=True)
+            copy.assert_not_called()
+
+            os.utime(path + ".zip", (0, 0))
+            Geonames(url, download=False, extract=True)
+            copy.assert_called_once()
+
     def test_city_wrong_timezone(self):
         """Load single city with wrong timezone."""
         fixture_dir = FixtureDir("import")
@@ -65,3 +182,410 @@ class TestImport(TestImportBase):
         cities = city_model.objects.all()
         for city in cities:
             print(city.get_timezone_info().zone)
+
+    def test_translation_cache(self):
+        """Parsed translations are cached with --hack-translations."""
+        cache_path = os.path.join(DATA_DIR, "translation_cache")
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        self.addCleanup(os.remove, cache_path)
+
+        fixture_dir = FixtureDir("import")
+        sources = (
+            fixture_dir,
+            "angouleme_country",
+            "angouleme_region",
+            "angouleme_subregion",
+            "angouleme_city",
+            "angouleme_translations",
+        )
+        self.import_data(*sources, hack_translations=True)
+        self.assertTrue(os.path.exists(cache_path))
+
+        Country, Region, SubRegion, City = get_cities_models()
+        City.objects.update(translations={}, alternate_names="")
+        with mock.patch.object(Command, "translation_parse") as m_parse:
+            self.import_data(*sources, hack_translations=True)
+        m_parse.assert_not_called()
+        Fixture(
+            fixture_dir.get_file_path("angouleme.json"), ignore_pk=True
+        ).assertNoDiff()
+
+        # the cache is outdated when TRANSLATION_LANGUAGES change
+        with mock.patch(
+            "cities_light.management.commands.cities_light.TRANSLATION_LANGUAGES",
+            ["fr"],
+        ):
+            with mock.patch.object(Command, "translation_parse") as m_parse:
+                self.import_data(*sources, hack_translations=True)
+        m_parse.assert_called()
+
+    def test_pre_import_batch(self):
+        """Rows removed by batch receivers are skipped."""
+        sources = (
+            FixtureDir("import"),
+            "angouleme_country",
+            "angouleme_region",
+            "angouleme_subregion",
+            "angouleme_city",
+            "angouleme_translations",
+        )
+
+        def filter_cities(sender, rows, **kwargs):
+            rows[:] = [items for items in rows if items[1] != "Angoulême"]
+
+        city_items_pre_import_batch.connect(filter_cities)
+        self.addCleanup(city_items_pre_import_batch.disconnect, filter_cities)
+        # the row signal is not sent without receivers
+        with mock.patch.object(city_items_pre_import, "send") as m_send:
+            self.import_data(*sources)
+        m_send.assert_not_called()
+        Country, Region, SubRegion, City = get_cities_models()
+        self.assertFalse(City.objects.exists())
+
+        city_items_pre_import_batch.disconnect(filter_cities)
+        with mock.patch("cities_light.receivers.INCLUDE_CITY_TYPES", ["PPLC"]):
+            self.import_data(*sources, batch_size=2)
+        self.assertFalse(City.objects.exists())
+
+    def test_per_row_filter(self):
+        """Built-in filters still work as deprecated per-row receivers."""
+        items = [""] * (ICity.modificationDate + 1)
+        items[ICity.featureCode] = "PPLC"
+        city_items_pre_import.connect(filter_non_cities)
+        self.addCleanup(city_items_pre_import.disconnect, filter_non_cities)
+        with self.assertWarns(DeprecationWarning):
+            city_items_pre_import.send(sender=self, items=items)
+
+        items[ICity.featureCode] = "ADM1"
+        with self.assertWarns(DeprecationWarning), self.assertRaises(InvalidItems):
+            city_items_pre_import.send(sender=self, items=items)
+
+    def test_parse_matching(self):
+        """Lines of other languages are skipped before they are parsed."""
+        path = FixtureDir("import").get_file_path("angouleme_translations.txt")
+        geonames = Geonames("file://%s" % path, download=False)
+        geonames.file_path = path
+
+        languages = ["fr", "en", "abbr", "post"]
+        rows = list(geonames.parse_matching(IAlternate.language, languages))
+        self.assertTrue(rows)
+        self.assertEqual(
+            rows,
+            [
+                row
+                for row in geonames.parse()
+                if len(row) > IAlternate.language
+                and row[IAlternate.language] in languages
+            ],
+        )
+
+    def test_line_filter(self):
+        """Lines which do not match the conditions are skipped."""
+        path = FixtureDir("import").get_file_path("angouleme_city.txt")
+        geonames = Geonames("file://%s" % path, download=False)
+        geonames.file_path = path
+
+        self.assertIsNone(line_filter({}))
+        rows = list(geonames.parse())
+        conditions = {
+            ICity.countryCode: {"FR"}.__contains__,
+            ICity.population: lambda population: int(population) > 1000,
+        }
+        self.assertEqual(
+            list(geonames.parse(line_filter=line_filter(conditions))), rows
+        )
+        conditions[ICity.countryCode] = {"BE"}.__contains__
+        self.assertEqual(list(geonames.parse(line_filter=line_filter(conditions))), [])
+
+        # workers only split the lines of their shard of countries
+        City = get_cities_models()[3]
+        command = Command()
+        shard = country_shard("FR", 3)
+        for other in range(3):
+            self.assertEqual(
+                list(
+                    geonames.parse(
+                        line_filter=command.source_line_filter(City, shard=(other, 3))
+                    )
+                ),
+                rows if other == shard else [],
+            )
+
+    def test_connected_filters(self):
+        """Only the conditions of connected built-in filters apply to lines."""
+        City = get_cities_models()[3]
+        command = Command()
+        self.assertIsNotNone(command.source_line_filter(City))
+
+        city_items_pre_import_batch.disconnect(filter_non_cities)
+        self.addCleanup(city_items_pre_import_batch.connect, filter_non_cities)
+        self.assertIsNone(command.source_line_filter(City))
+
+        city_items_pre_import_batch.connect(filter_non_cities, dispatch_uid="uid")
+        self.assertIsNotNone(command.source_line_filter(City))
+        city_items_pre_import_batch.disconnect(dispatch_uid="uid")
+        self.assertIsNone(command.source_line_filter(City))
+
+    def test_tell(self):
+        """Progress is measured in bytes read, without counting lines."""
+        path = FixtureDir("import").get_file_path("angouleme_translations.txt")
+        geonames = Geonames("file://%s" % path, download=False)
+        geonames.file_path = path
+
+        rows = geonames.parse()
+        next(rows)
+        self.assertGreater(geonames.tell(), 0)
+        self.assertLessEqual(geonames.tell(), os.path.getsize(path))
+        list(rows)
+        self.assertEqual(geonames.tell(), os.path.getsize(path))
+
+        with mock.patch.object(Geonames, "num_lines") as m_num_lines:
+            self.import_data(
+                FixtureDir("import"),
+                "angouleme_country",
+                "angouleme_region",
+                "angouleme_subregion",
+                "angouleme_city",
+                "angouleme_translations",
+            )
+        m_num_lines.assert_not_called()
+
+    def test_include_settings(self):
+        """INCLUDE_COUNTRIES and MIN_CITY_POPULATION filter lines."""
+        sources = (
+            FixtureDir("import"),
+            "angouleme_country",
+            "angouleme_region",
+            "angouleme_subregion",
+            "angouleme_city",
+            "angouleme_translations",
+        )
+        Country, Region, SubRegion, City = get_cities_models()
+        command = "cities_light.management.commands.cities_light"
+        with (
+            mock.patch("%s.MIN_CITY_POPULATION" % command, 50000),
+            mock.patch("cities_light.receivers.MIN_CITY_POPULATION", 50000),
+        ):
+            self.import_data(*sources)
+        self.assertTrue(Region.objects.exists())
+        self.assertFalse(City.objects.exists())
+
+        Country.objects.all().delete()
+        with (
+            mock.patch("%s.INCLUDE_COUNTRIES" % command, ["BE"]),
+            mock.patch("cities_light.receivers.INCLUDE_COUNTRIES", ["BE"]),
+            mock.patch.object(Command, "city_import") as m_import,
+        ):
+            self.import_data(*sources)
+        self.assertFalse(Country.objects.exists())
+        m_import.assert_not_called()
+
+    def test_diff(self):
+        """Rows are diffed by key against the last imported copy."""
+        geonames = Geonames("file:///diff_test.txt", download=False)
+        self.addCleanup(os.remove, geonames.file_path)
+        self.addCleanup(os.remove, geonames.imported_path)
+
+        with open(geonames.file_path, "w") as f:
+            f.write("1\tone\n2\ttwo\n3\tthree\n")
+        self.assertEqual(
+            list(geonames.diff(0)),
+            [
+                ("added", ["1", "one"]),
+                ("added", ["2", "two"]),
+                ("added", ["3", "three"]),
+            ],
+        )
+        geonames.mark_imported()
+
+        with open(geonames.file_path, "w") as f:
+            f.write("4\tfour\n3\tthree\n1\tuno\n")
+        self.assertEqual(
+            list(geonames.diff(0)),
+            [
+                ("added", ["4", "four"]),
+                ("unchanged", ["3", "three"]),
+                ("changed", ["1", "uno"]),
+                ("removed", ["2", "two"]),
+            ],
+        )
+
+        # the copy is stale when its tag changes
+        with geonames.write_imported("parents=1") as add_imported:
+            add_imported(["4", "four"])
+        self.assertEqual(list(geonames.diff(0, "parents=1"))[0][0], "unchanged")
+        self.assertEqual(
+            [status for status, items in geonames.diff(0, "parents=2")],
+            ["added", "added", "added"],
+        )
+
+    def test_identity_maps(self):
+        """Identity maps are loaded once and misses do not query."""
+        fixture_dir = FixtureDir("import")
+        self.import_data(
+            fixture_dir,
+            "angouleme_country",
+            "angouleme_region",
+            "angouleme_subregion",
+            "angouleme_city",
+            "angouleme_translations",
+        )
+        Country, Region, SubRegion, City = get_cities_models()
+        city = City.objects.select_related("country", "region", "subregion").get()
+
+        command = Command()
+        command._clear_identity_maps()
+        with self.assertNumQueries(3):
+            for i in range(3):
+                self.assertEqual(
+                    command._get_subregion_id(
+                        city.country.code2,
+                        city.region.geoname_code,
+                        city.subregion.geoname_code,
+                    ),
+                    city.subregion_id,
+                )
+                with self.assertRaises(Country.DoesNotExist):
+                    command._get_country_id("XX")
+                with self.assertRaises(Region.DoesNotExist):
+                    command._get_region_id(city.country.code2, "XX")
+                with self.assertRaises(SubRegion.DoesNotExist):
+                    command._get_subregion_id(
+                        city.country.code2, city.region.geoname_code, "XX"
+                    )
+
+    def assertDerivedFields(self):
+        """Assert display_name and search_names match their receivers."""
+        Country, Region, SubRegion, City = get_cities_models()
+        for city in City.objects.select_related("country", "region"):
+            self.assertEqual(city.display_name, city.get_display_name())
+            self.assertEqual(
+                city.search_names,
+                get_search_names(
+                    get_names(city),
+                    get_names(city.region) if city.region_id else set(),
+                    get_names(city.country),
+                ),
+            )
+
+    def test_city_import_worker(self):
+        """Worker processes import the cities of their countries."""
+        fixture_dir = FixtureDir("update")
+        self.import_data(
+            fixture_dir,
+            "add_country",
+            "add_region",
+            "add_subregion",
+            "add_city",
+            "add_translations",
+        )
+        Country, Region, SubRegion, City = get_cities_models()
+        cities = set(City.objects.values_list("geoname_id", "country__code2"))
+
+        url = "file://%s.txt" % fixture_dir.get_file_path("add_city")
+        for batch_size in (0, 2):
+            City.objects.all().delete()
+            # workers are forked from a command which suspended the derived
+            # fields receivers with --batch-size
+            parent = Command()
+            suspend = contextlib.nullcontext()
+            if batch_size:
+                suspend = parent.suspend_derived_fields()
+
+            with (
+                mock.patch(
+                    "cities_light.management.commands.cities_light.CITY_SOURCES",
+                    [url],
+                ),
+                suspend,
+            ):
+                options = dict(
+                    noinsert=False,
+                    keep_slugs=False,
+                    batch_size=batch_size,
+                    engine=OrmEngine,
+                    extract=False,
+                    prune=True,
+                    suspended_receivers=parent._suspended_receivers,
+                )
+                for shard in range(3):
+                    stats, seen = city_import_worker(url, shard, 3, options)
+                    self.assertEqual(
+                        set(City.objects.values_list("geoname_id", "country__code2")),
+                        {
+                            (geoname_id, code2)
+                            for geoname_id, code2 in cities
+                            if country_shard(code2, 3) <= shard
+                        },
+                    )
+                    self.assertEqual(
+                        stats["created"],
+                        len([c for c in cities if country_shard(c[1], 3) == shard]),
+                    )
+                    self.assertEqual(
+                        {
+                            geoname_id
+                            for geoname_id, code2 in cities
+                            if geoname_id in seen
+                        },
+                        {
+                            geoname_id
+                            for geoname_id, code2 in cities
+                            if country_shard(code2, 3) == shard
+                        },
+                    )
+            self.assertDerivedFields()
+
+
+@unittest.skipIf(
+    connection.vendor == "sqlite", "SQLite does not support concurrent writes"
+)
+@unittest.skipUnless(
+    multiprocessing.get_start_method() == "fork",
+    "workers must inherit the patched sources",
+)
+class TestWorkers(TransactionTestCase):
+    """Import cities with several processes."""
+
+    import_data = TestImportBase.import_data
+
+    def test_workers(self):
+        """Workers import every city with its derived fields."""
+        fixture_dir = FixtureDir("update")
+        for batch_size in (0, 2):
+            with self.subTest(batch_size=batch_size):
+                get_cities_models()[0].objects.all().delete()
+                for prefix in ("initial", "add"):
+                    self.import_data(
+                        fixture_dir,
+                        "%s_country" % prefix,
+                        "%s_region" % prefix,
+                        "%s_subregion" % prefix,
+                        "%s_city" % prefix,
+                        "%s_translations" % prefix,
+                        workers=2,
+                        batch_size=batch_size,
+                    )
+                Fixture(
+                    fixture_dir.get_file_path("add_records.json"), ignore_pk=True
+                ).assertNoDiff()
+
+    def test_workers_prune(self):
+        """Rows imported by workers are not pruned."""
+        fixture_dir = FixtureDir("update")
+        for prefix in ("remove_initial", "remove"):
+            self.import_data(
+                fixture_dir,
+                "%s_country" % prefix,
+                "%s_region" % prefix,
+                "%s_subregion" % prefix,
+                "%s_city" % prefix,
+                "%s_translations" % prefix,
+                workers=2,
+                prune=True,
+                prune_threshold=1,
+            )
+        Fixture(
+            fixture_dir.get_file_path("remove_records.json"), ignore_pk=True
+        ).assertNoDiff()
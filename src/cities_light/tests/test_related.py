@@ -0,0 +1,56 @@
+"""Tests for the related object cache."""
+
+from .base import TestImportBase, FixtureDir
+from ..loading import get_cities_models
+from ..related import clear_related_cache, related_cache
+
+
+class TestRelatedCache(TestImportBase):
+    """Test related_cache."""
+
+    def setUp(self):
+        self.import_data(
+            FixtureDir("import"),
+            "angouleme_country",
+            "angouleme_region",
+            "angouleme_subregion",
+            "angouleme_city",
+            "angouleme_translations",
+        )
+        self.Country, self.Region, self.SubRegion, self.City = get_cities_models()
+
+    def test_save_city(self):
+        """Saving a city only queries its region and country once."""
+        with related_cache():
+            with self.assertNumQueries(4):
+                self.City.objects.get().save()
+
+            city = self.City.objects.get()
+            with self.assertNumQueries(1):
+                city.save()
+            self.assertEqual(city.display_name, "Angoulême, Nouvelle-Aquitaine, France")
+
+    def test_save_related(self):
+        """Saved objects are dropped from the cache."""
+        with related_cache():
+            self.City.objects.get().save()
+
+            region = self.Region.objects.get()
+            region.name = "Charente"
+            region.save()
+
+            city = self.City.objects.get()
+            city.save()
+            self.assertEqual(city.display_name, "Angoulême, Charente, France")
+
+    def test_clear(self):
+        """Objects changed in bulk are dropped with clear_related_cache()."""
+        with related_cache():
+            self.City.objects.get().save()
+
+            self.Country.objects.update(name="République française")
+            clear_related_cache(self.Country)
+
+            city = self.City.objects.get()
+            city.save()
+            self.assertIn("République française", city.display_name)
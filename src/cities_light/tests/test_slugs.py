@@ -0,0 +1,106 @@
+"""Tests for the slug planner."""
+
+from .base import TestImportBase, FixtureDir
+from ..loading import get_cities_models
+from ..slugs import SlugPlanner, slug_scope
+
+
+class TestSlugPlanner(TestImportBase):
+    """Test SlugPlanner."""
+
+    def setUp(self):
+        self.Country, self.Region, self.SubRegion, self.City = get_cities_models()
+        self.country = self.Country.objects.create(
+            name="France", name_ascii="France", geoname_id=3017382
+        )
+        self.region = self.Region.objects.create(
+            name="Charente",
+            name_ascii="Charente",
+            country=self.country,
+            geoname_id=3026644,
+        )
+
+    def new_region(self, geoname_id, name_ascii, slug=None):
+        return self.Region(
+            name=name_ascii,
+            name_ascii=name_ascii,
+            slug=slug,
+            country=self.country,
+            geoname_id=geoname_id,
+        )
+
+    def test_scope(self):
+        """Scopes are read from unique_together."""
+        self.assertIsNone(slug_scope(self.Country))
+        self.assertEqual(slug_scope(self.Region), ("country_id",))
+        self.assertEqual(slug_scope(self.City), ("region_id", "subregion_id"))
+
+    def test_collisions(self):
+        """Collisions are suffixed in the order slugs are assigned."""
+        planner = SlugPlanner(self.Region)
+        regions = [self.new_region(1, "Charente"), self.new_region(2, "Charente")]
+        for region in regions:
+            planner.assign(region)
+        self.assertEqual([r.slug for r in regions], ["charente-2", "charente-3"])
+
+        # the slug of a row is available to itself
+        region = self.Region.objects.get()
+        region.slug = None
+        planner.assign(region)
+        self.assertEqual(region.slug, "charente")
+
+    def test_taken_slug(self):
+        """Slugs taken by another row are changed unless kept."""
+        planner = SlugPlanner(self.Region)
+        region = self.new_region(1, "Poitou", slug="charente")
+        planner.assign(region, keep=True)
+        self.assertEqual(region.slug, "charente")
+
+        region = self.new_region(2, "Poitou", slug="charente")
+        planner.assign(region)
+        self.assertEqual(region.slug, "charente-2")
+
+    def test_renamed(self):
+        """Slugs are released when a row changes slug."""
+        planner = SlugPlanner(self.Region)
+        region = self.Region.objects.get()
+        region.name_ascii = "Charente Maritime"
+        region.slug = None
+        planner.assign(region)
+        self.assertEqual(region.slug, "charente-maritime")
+
+        region = self.new_region(1, "Charente")
+        planner.assign(region)
+        self.assertEqual(region.slug, "charente")
+
+    def test_null_scope(self):
+        """Rows with a NULL scope field never collide."""
+        planner = SlugPlanner(self.City)
+        cities = [
+            self.City(name_ascii="Paris", country=self.country, geoname_id=i)
+            for i in range(2)
+        ]
+        for city in cities:
+            planner.assign(city)
+        self.assertEqual([c.slug for c in cities], ["paris", "paris"])
+
+    def test_import_keeps_slug(self):
+        """Slugs only change when name_ascii changes."""
+        sources = (
+            FixtureDir("import"),
+            "angouleme_country",
+            "angouleme_region",
+            "angouleme_subregion",
+            "angouleme_city",
+            "angouleme_translations",
+        )
+        self.Country.objects.all().delete()
+        self.import_data(*sources)
+        self.City.objects.update(slug="custom", population=0)
+        self.import_data(*sources)
+        city = self.City.objects.get()
+        self.assertEqual((city.slug, city.population), ("custom", 49468))
+
+        self.City.objects.update(name_ascii="")
+        self.import_data(*sources, batch_size=2)
+        self.assertEqual(self.City.objects.get().slug, "angouleme")
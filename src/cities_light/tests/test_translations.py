@@ -0,0 +1,69 @@
+"""Tests for the translation store."""
+
+import os
+import tempfile
+import unittest
+
+from ..loading import get_cities_model
+from ..translations import (
+    TranslationStore,
+    read_translation_cache,
+    write_translation_cache,
+)
+
+
+class TestTranslationStore(unittest.TestCase):
+    """Test TranslationStore."""
+
+    def setUp(self):
+        self.store = TranslationStore()
+        self.store.add(3, "fr", "Angoulême")
+        self.store.add(1, "en", "Paris")
+        self.store.add(3, "en", "Angouleme")
+        self.store.add(1, "ru", "Париж")
+        self.store.add(3, "fr", "Engoulême")
+
+    def test_items(self):
+        """Test translations are sorted by geoname id in insertion order."""
+        self.assertEqual(
+            list(self.store.items()),
+            [
+                (1, {"en": ["Paris"], "ru": ["Париж"]}),
+                (3, {"fr": ["Angoulême", "Engoulême"], "en": ["Angouleme"]}),
+            ],
+        )
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(self.store.languages, ["fr", "en", "ru"])
+
+    def test_get(self):
+        """Test translations lookup by geoname id."""
+        self.assertEqual(self.store.get(1), {"en": ["Paris"], "ru": ["Париж"]})
+        self.assertIsNone(self.store.get(2))
+        self.assertIn(3, self.store)
+        self.assertNotIn(4, self.store)
+
+    def test_add_after_freeze(self):
+        """Test names added after reading are found."""
+        self.assertEqual(len(self.store), 2)
+        self.store.add(2, "en", "Lyon")
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store.get(2), {"en": ["Lyon"]})
+
+    def test_chunks(self):
+        """Test translations are read in chunks."""
+        self.store.add(2, "en", "Lyon")
+        self.assertEqual([list(chunk) for chunk in self.store.chunks(2)], [[1, 2], [3]])
+
+    def test_cache(self):
+        """Test stores are read back from a tagged cache file."""
+        Country = get_cities_model("Country")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "translation_cache")
+            write_translation_cache(path, {Country: self.store}, {"source": 1})
+
+            self.assertIsNone(read_translation_cache(path, {"source": 2}))
+            data = read_translation_cache(path, {"source": 1})
+            self.assertEqual(list(data), [Country])
+            self.assertEqual(list(data[Country].items()), list(self.store.items()))
+            self.assertEqual(data[Country].get(3), self.store.get(3))
+            del data
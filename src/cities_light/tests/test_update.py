@@ -1,9 +1,20 @@
 """Tests for update records."""
 
-import unittest
+import datetime
+import glob
+import os
+import pickle
+from unittest import mock
+
+from django.core import management
+from django.core.management.base import CommandError
+from django.db.models import QuerySet
 
 from dbdiff.fixture import Fixture
+from cities_light.management.commands.cities_light import Command
 from .base import TestImportBase, FixtureDir
+from ..loading import get_cities_model
+from ..settings import DATA_DIR
 
 
 class TestUpdate(TestImportBase):
@@ -35,6 +46,34 @@ class TestUpdate(TestImportBase):
             fixture_dir.get_file_path("update_fields.json"), ignore_pk=True
         ).assertNoDiff()
 
+    def test_update_fields_batch(self):
+        """Test all fields are updated with bulk queries."""
+        fixture_dir = FixtureDir("update")
+
+        self.import_data(
+            fixture_dir,
+            "initial_country",
+            "initial_region",
+            "initial_subregion",
+            "initial_city",
+            "initial_translations",
+            batch_size=2,
+        )
+
+        self.import_data(
+            fixture_dir,
+            "update_country",
+            "update_region",
+            "update_subregion",
+            "update_city",
+            "update_translations",
+            batch_size=2,
+        )
+
+        Fixture(
+            fixture_dir.get_file_path("update_fields.json"), ignore_pk=True
+        ).assertNoDiff()
+
     def test_update_fields_wrong_timezone(self):
         """Test all fields are updated, but timezone field is wrong."""
         fixture_dir = FixtureDir("update")
@@ -193,10 +232,343 @@ class TestUpdate(TestImportBase):
             fixture_dir.get_file_path("noinsert.json"), ignore_pk=True
         ).assertNoDiff()
 
-    # TODO: make the test pass
-    @unittest.skip("Obsolete records are not removed yet.")
+    def test_unchanged_records_not_saved(self):
+        """Test that records matching the database are not saved again."""
+        fixture_dir = FixtureDir("update")
+        sources = (
+            fixture_dir,
+            "initial_country",
+            "initial_region",
+            "initial_subregion",
+            "initial_city",
+            "initial_translations",
+        )
+
+        self.import_data(*sources)
+        with mock.patch.object(Command, "save", autospec=True) as m_save:
+            with mock.patch.object(QuerySet, "bulk_update") as m_bulk_update:
+                with self.assertLogs("cities_light", "INFO") as logs:
+                    self.import_data(*sources)
+
+        m_save.assert_not_called()
+        m_bulk_update.assert_not_called()
+        self.assertIn(
+            "INFO:cities_light:Imported initial_city.txt: 0 created, 0 updated,"
+            " 2 skipped",
+            logs.output,
+        )
+
+    def test_hash_rows(self):
+        """Test that rows which did not change in the source are skipped."""
+        hash_paths = os.path.join(DATA_DIR, "*.hashes")
+        for path in glob.glob(hash_paths):
+            os.remove(path)
+        self.addCleanup(lambda: [os.remove(p) for p in glob.glob(hash_paths)])
+
+        fixture_dir = FixtureDir("update")
+        self.import_data(
+            fixture_dir,
+            "initial_country",
+            "initial_region",
+            "initial_subregion",
+            "initial_city",
+            "initial_translations",
+            hash_rows=True,
+        )
+
+        sources = (
+            fixture_dir,
+            "update_country",
+            "update_region",
+            "update_subregion",
+            "update_city",
+            "update_translations",
+        )
+        self.import_data(*sources, hash_rows=True)
+        Fixture(
+            fixture_dir.get_file_path("update_fields.json"), ignore_pk=True
+        ).assertNoDiff()
+
+        with mock.patch.object(Command, "_city_values", autospec=True) as m_values:
+            with mock.patch.object(QuerySet, "bulk_update") as m_bulk_update:
+                with self.assertLogs("cities_light", "INFO") as logs:
+                    self.import_data(*sources, hash_rows=True)
+
+        m_values.assert_not_called()
+        m_bulk_update.assert_not_called()
+        self.assertIn(
+            "INFO:cities_light:Imported update_city.txt: 0 created, 0 updated,"
+            " 3 skipped",
+            logs.output,
+        )
+
+    def test_hash_rows_parents(self):
+        """Test that rows are imported again when their parents change."""
+        hash_paths = os.path.join(DATA_DIR, "*.hashes")
+        for path in glob.glob(hash_paths):
+            os.remove(path)
+        self.addCleanup(lambda: [os.remove(p) for p in glob.glob(hash_paths)])
+
+        fixture_dir = FixtureDir("update")
+        self.import_data(
+            fixture_dir,
+            "initial_country",
+            [],
+            [],
+            "initial_city",
+            "initial_translations",
+            hash_rows=True,
+        )
+        City = get_cities_model("City")
+        self.assertFalse(City.objects.filter(region__isnull=False).exists())
+
+        self.import_data(
+            fixture_dir,
+            "initial_country",
+            "initial_region",
+            "initial_subregion",
+            "initial_city",
+            "initial_translations",
+            hash_rows=True,
+        )
+        self.assertFalse(City.objects.filter(region__isnull=True).exists())
+
+    def test_parents_checksum(self):
+        """Test that parent rows are only checksummed with --hash-rows."""
+        fixture_dir = FixtureDir("update")
+        with mock.patch.object(
+            Command, "_parents_checksum", autospec=True
+        ) as m_checksum:
+            self.import_data(
+                fixture_dir,
+                "initial_country",
+                "initial_region",
+                "initial_subregion",
+                "initial_city",
+                "initial_translations",
+            )
+        m_checksum.assert_not_called()
+
+    def test_diff(self):
+        """Test that only lines changed since the last import are imported."""
+        imported_paths = os.path.join(DATA_DIR, "*.imported")
+        for path in glob.glob(imported_paths):
+            os.remove(path)
+        self.addCleanup(lambda: [os.remove(p) for p in glob.glob(imported_paths)])
+
+        fixture_dir = FixtureDir("update")
+        sources = (
+            fixture_dir,
+            "initial_country",
+            "initial_region",
+            "initial_subregion",
+            "initial_city",
+            "initial_translations",
+        )
+        self.import_data(*sources, diff=True)
+
+        with mock.patch.object(Command, "city_import", autospec=True) as m_import:
+            self.import_data(*sources, diff=True)
+        m_import.assert_not_called()
+
+        self.import_data(
+            fixture_dir,
+            "update_country",
+            "update_region",
+            "update_subregion",
+            "update_city",
+            "update_translations",
+            diff=True,
+        )
+        Fixture(
+            fixture_dir.get_file_path("update_fields.json"), ignore_pk=True
+        ).assertNoDiff()
+
+    def test_diff_parents(self):
+        """Test that --diff imports rows again when their parents change."""
+        imported_paths = os.path.join(DATA_DIR, "*.imported")
+        for path in glob.glob(imported_paths):
+            os.remove(path)
+        self.addCleanup(lambda: [os.remove(p) for p in glob.glob(imported_paths)])
+
+        fixture_dir = FixtureDir("update")
+        self.import_data(
+            fixture_dir,
+            "initial_country",
+            [],
+            [],
+            "initial_city",
+            "initial_translations",
+            diff=True,
+        )
+        City = get_cities_model("City")
+        self.assertFalse(City.objects.filter(region__isnull=False).exists())
+
+        self.import_data(
+            fixture_dir,
+            "initial_country",
+            "initial_region",
+            "initial_subregion",
+            "initial_city",
+            "initial_translations",
+            diff=True,
+        )
+        self.assertFalse(City.objects.filter(region__isnull=True).exists())
+
+    def test_diff_imported_rows(self):
+        """Test that --diff retries rows which were not imported."""
+        imported_paths = os.path.join(DATA_DIR, "*.imported")
+        for path in glob.glob(imported_paths):
+            os.remove(path)
+        self.addCleanup(lambda: [os.remove(p) for p in glob.glob(imported_paths)])
+
+        sources = (
+            FixtureDir("update"),
+            "initial_country",
+            "initial_region",
+            "initial_subregion",
+            "initial_city",
+            "initial_translations",
+        )
+        with (
+            mock.patch("cities_light.receivers.INCLUDE_CITY_TYPES", ["PPLA"]),
+            mock.patch(
+                "cities_light.management.commands.cities_light.INCLUDE_CITY_TYPES",
+                ["PPLA"],
+            ),
+        ):
+            self.import_data(*sources, diff=True)
+        City = get_cities_model("City")
+        self.assertEqual(
+            list(City.objects.values_list("name", flat=True)), ["Kemerovo"]
+        )
+
+        self.import_data(*sources, diff=True)
+        self.assertEqual(
+            sorted(City.objects.values_list("name", flat=True)),
+            ["Kemerovo", "Novokuznetsk"],
+        )
+
+    def test_diff_stale_copy(self):
+        """Test that imports without --diff drop the copy of the last one."""
+        imported_paths = os.path.join(DATA_DIR, "*.imported")
+        for path in glob.glob(imported_paths):
+            os.remove(path)
+        self.addCleanup(lambda: [os.remove(p) for p in glob.glob(imported_paths)])
+
+        sources = (
+            FixtureDir("update"),
+            "initial_country",
+            "initial_region",
+            "initial_subregion",
+            "initial_city",
+            "initial_translations",
+        )
+        self.import_data(*sources, diff=True)
+        self.assertTrue(glob.glob(imported_paths))
+
+        self.import_data(*sources)
+        self.assertFalse(glob.glob(imported_paths))
+
+        # all rows are imported by the next --diff
+        City = get_cities_model("City")
+        City.objects.filter(geoname_id=1503901).update(name="Forest Glade")
+        self.import_data(*sources, diff=True)
+        self.assertEqual(City.objects.get(geoname_id=1503901).name, "Kemerovo")
+
+    @mock.patch(
+        "cities_light.management.commands.cities_light.TRANSLATION_LANGUAGES",
+        ["en", "de", "ja"],
+    )
+    def incremental_import(self, **options):
+        """Import the initial data, then apply the incremental fixtures."""
+        date_path = os.path.join(DATA_DIR, "incremental_date")
+        if os.path.exists(date_path):
+            os.remove(date_path)
+        self.addCleanup(os.remove, date_path)
+
+        fixture_dir = FixtureDir("update")
+        self.import_data(
+            fixture_dir,
+            "initial_country",
+            "initial_region",
+            "initial_subregion",
+            "initial_city",
+            "initial_translations",
+        )
+        with open(os.path.join(DATA_DIR, "install_datetime"), "wb") as f:
+            pickle.dump(datetime.datetime(2024, 1, 2, 12), f)
+
+        with mock.patch(
+            "cities_light.management.commands.cities_light.INCREMENTAL_BASE_URL",
+            "file://%s/" % FixtureDir("incremental").get_file_path(""),
+        ):
+            management.call_command("cities_light", incremental=True, **options)
+
+        with open(date_path) as f:
+            self.assertEqual(f.read(), "2024-01-03")
+
+    def test_incremental(self):
+        """Test geonames daily files are applied since the last import."""
+        self.incremental_import()
+
+        # 1496991 is a new city of the daily files, 1496990 was deleted
+        City = get_cities_model("City")
+        self.assertEqual(
+            sorted(City.objects.values_list("geoname_id", "population")),
+            [(1503901, 500000)],
+        )
+        self.assertEqual(
+            City.objects.get(geoname_id=1503901).translations,
+            {"en": ["Kemerovo", "Kemerovo City"], "ja": ["ケメロヴォ"]},
+        )
+
+    def test_incremental_insert(self):
+        """Test new cities of daily files are inserted on demand only."""
+        self.incremental_import(incremental_insert=True)
+
+        City = get_cities_model("City")
+        self.assertEqual(
+            sorted(City.objects.values_list("geoname_id", "population")),
+            [(1496991, 539616), (1503901, 500000)],
+        )
+
+    def test_incremental_gap(self):
+        """Test daily files which are not published anymore stop the command."""
+        date_path = os.path.join(DATA_DIR, "incremental_date")
+        with open(date_path, "w") as f:
+            f.write("2023-12-31")
+        self.addCleanup(os.remove, date_path)
+        with open(os.path.join(DATA_DIR, "install_datetime"), "wb") as f:
+            pickle.dump(datetime.datetime(2024, 1, 1, 12), f)
+
+        class Date(datetime.date):
+            @classmethod
+            def today(cls):
+                return cls(2024, 1, 4)
+
+        with (
+            mock.patch(
+                "cities_light.management.commands.cities_light.INCREMENTAL_BASE_URL",
+                "file://%s/" % FixtureDir("incremental").get_file_path(""),
+            ),
+            mock.patch(
+                "cities_light.management.commands.cities_light.datetime",
+                mock.Mock(wraps=datetime, date=Date),
+            ),
+            self.assertRaisesMessage(
+                CommandError,
+                "Geonames updates of 2024-01-01 are not published anymore, but"
+                " those of 2024-01-03 are: run a full import to catch up",
+            ),
+        ):
+            management.call_command("cities_light", incremental=True)
+
+        with open(date_path) as f:
+            self.assertEqual(f.read(), "2023-12-31")
+
     def test_remove_records(self):
-        """Test that obsolete records are removed."""
+        """Test that obsolete records are removed with --prune."""
         fixture_dir = FixtureDir("update")
 
         self.import_data(
@@ -215,8 +587,74 @@ class TestUpdate(TestImportBase):
             "remove_subregion",
             "remove_city",
             "remove_translations",
+            prune=True,
+            prune_threshold=1,
         )
 
         Fixture(
             fixture_dir.get_file_path("remove_records.json"), ignore_pk=True
         ).assertNoDiff()
+
+    def test_prune_threshold(self):
+        """Test that rows are not pruned above the threshold."""
+        fixture_dir = FixtureDir("update")
+
+        self.import_data(
+            fixture_dir,
+            "remove_initial_country",
+            "remove_initial_region",
+            "remove_initial_subregion",
+            "remove_initial_city",
+            "remove_initial_translations",
+        )
+
+        with self.assertLogs("cities_light", "WARNING") as logs:
+            self.import_data(
+                fixture_dir,
+                "remove_country",
+                "remove_region",
+                "remove_subregion",
+                "remove_city",
+                "remove_translations",
+                prune=True,
+            )
+
+        self.assertIn(
+            "WARNING:cities_light:Not pruning cities: 1 of 2 rows are not in the"
+            " sources, more than --prune-threshold=0.1",
+            logs.output,
+        )
+        self.assertEqual(get_cities_model("City").objects.count(), 2)
+
+    def test_prune_cascade_threshold(self):
+        """Test that rows are not pruned above the threshold of cascades."""
+        fixture_dir = FixtureDir("update")
+        self.import_data(
+            fixture_dir,
+            "prune_initial_country",
+            "remove_initial_region",
+            "remove_initial_subregion",
+            "remove_initial_city",
+            "remove_initial_translations",
+        )
+
+        # 1 of 3 countries is stale, but it has 1 of the 2 cities
+        with self.assertLogs("cities_light", "WARNING") as logs:
+            self.import_data(
+                fixture_dir,
+                "prune_country",
+                "remove_initial_region",
+                "remove_initial_subregion",
+                "remove_initial_city",
+                "remove_initial_translations",
+                prune=True,
+                prune_threshold=0.4,
+            )
+
+        self.assertIn(
+            "WARNING:cities_light:Not pruning countries: 1 of 2 regions/states"
+            " would be deleted with them, more than --prune-threshold=0.4",
+            logs.output,
+        )
+        self.assertEqual(get_cities_model("Country").objects.count(), 3)
+        self.assertEqual(get_cities_model("City").objects.count(), 2)
@@ -0,0 +1,306 @@
+"""
+Compact storage for the translations parsed from alternateNames, and an
+on-disk cache of them used by the --hack-translations option.
+"""
+
+import array
+import bisect
+import collections
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+from django.apps import apps
+
+__all__ = [
+    "TranslationStore",
+    "source_tag",
+    "write_translation_cache",
+    "read_translation_cache",
+]
+
+CACHE_MAGIC = b"CLTRANS\0"
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct("<8sQ")
+
+
+class TranslationStore:
+    """
+    Translations of the rows of one model, parsed from alternateNames.
+
+    A dict of geoname_id -> dict of lang -> list of names costs a few hundred
+    bytes of Python objects per name, instead each name is stored as an
+    entry in typed arrays:
+
+    - the geoname id of the entry,
+    - the index of the entry language in a list of interned language codes,
+    - the end offset of the entry name in a shared UTF-8 buffer.
+
+    Once all names are added, :py:meth:`freeze` sorts the entries by geoname
+    id in a :py:attr:`geoname_ids` array, and translations can be read one
+    geoname at a time in the same {lang: [names]} format as the
+    ``translations`` model field.
+
+    Stores read from a translation cache are frozen and read-only, their
+    arrays are views on the memory-mapped file.
+    """
+
+    def __init__(self):
+        self.languages = []
+        self._language_indexes = {}
+
+        self._entry_geoname_ids = array.array("q")
+        self._entry_languages = array.array("H")
+        self._entry_name_ends = array.array("Q")
+        self._names = bytearray()
+
+        # set by freeze()
+        self.geoname_ids = None
+        self._starts = None
+        self._order = None
+
+    def add(self, geoname_id, lang, name):
+        """Add a name in lang for geoname_id."""
+        index = self._language_indexes.get(lang)
+        if index is None:
+            index = self._language_indexes[lang] = len(self.languages)
+            self.languages.append(lang)
+
+        self._entry_geoname_ids.append(geoname_id)
+        self._entry_languages.append(index)
+        self._names += name.encode("utf-8")
+        self._entry_name_ends.append(len(self._names))
+        self.geoname_ids = None
+
+    def freeze(self):
+        """
+        Sort entries by geoname id, names of a geoname keep the order in
+        which they were added.
+        """
+        if self.geoname_ids is not None:
+            return
+
+        entry_geoname_ids = self._entry_geoname_ids
+        order = array.array(
+            "Q",
+            sorted(range(len(entry_geoname_ids)), key=entry_geoname_ids.__getitem__),
+        )
+
+        geoname_ids = array.array("q")
+        starts = array.array("Q")
+        for position, entry in enumerate(order):
+            geoname_id = entry_geoname_ids[entry]
+            if not geoname_ids or geoname_ids[-1] != geoname_id:
+                geoname_ids.append(geoname_id)
+                starts.append(position)
+        starts.append(len(order))
+
+        self._order = order
+        self._starts = starts
+        self.geoname_ids = geoname_ids
+
+    def __len__(self):
+        self.freeze()
+        return len(self.geoname_ids)
+
+    def __contains__(self, geoname_id):
+        return self._index(geoname_id) is not None
+
+    def _index(self, geoname_id):
+        self.freeze()
+        index = bisect.bisect_left(self.geoname_ids, geoname_id)
+        if index < len(self.geoname_ids) and self.geoname_ids[index] == geoname_id:
+            return index
+
+    @classmethod
+    def from_sorted(
+        cls, languages, geoname_ids, starts, entry_languages, entry_name_ends, names
+    ):
+        """Return a frozen store of entries already sorted by geoname id."""
+        store = cls()
+        store.languages = languages
+        store._entry_languages = entry_languages
+        store._entry_name_ends = entry_name_ends
+        store._names = names
+        store._starts = starts
+        store.geoname_ids = geoname_ids
+        return store
+
+    def _entries(self, index):
+        entries = range(self._starts[index], self._starts[index + 1])
+        if self._order is None:
+            return entries
+        return self._order[entries.start : entries.stop]
+
+    def _translations(self, index):
+        translations = {}
+        for entry in self._entries(index):
+            start = self._entry_name_ends[entry - 1] if entry else 0
+            name = str(self._names[start : self._entry_name_ends[entry]], "utf-8")
+            lang = self.languages[self._entry_languages[entry]]
+            translations.setdefault(lang, []).append(name)
+        return translations
+
+    def get(self, geoname_id, default=None):
+        """Return the {lang: [names]} translations of geoname_id."""
+        index = self._index(geoname_id)
+        if index is None:
+            return default
+        return self._translations(index)
+
+    def items(self):
+        """Yield (geoname_id, translations) by increasing geoname id."""
+        for index in range(len(self)):
+            yield self.geoname_ids[index], self._translations(index)
+
+    def chunks(self, size):
+        """Yield dicts of geoname_id: translations of at most size items."""
+        chunk = {}
+        for geoname_id, translations in self.items():
+            chunk[geoname_id] = translations
+            if len(chunk) == size:
+                yield chunk
+                chunk = {}
+        if chunk:
+            yield chunk
+
+    def write(self, f):
+        """
+        Write the entries to the f binary file sorted by geoname id, return
+        the offsets and lengths of the arrays in a dict.
+        """
+        self.freeze()
+        entry_languages = array.array("H")
+        entry_name_ends = array.array("Q")
+
+        sections = {}
+
+        def section(name, data):
+            # align arrays on 8 bytes
+            f.write(b"\0" * (-f.tell() % 8))
+            sections[name] = [f.tell(), len(data)]
+            f.write(data)
+
+        start = f.tell()
+        size = 0
+        for index in range(len(self.geoname_ids)):
+            for entry in self._entries(index):
+                name_start = self._entry_name_ends[entry - 1] if entry else 0
+                name = self._names[name_start : self._entry_name_ends[entry]]
+                f.write(name)
+                size += len(name)
+                entry_languages.append(self._entry_languages[entry])
+                entry_name_ends.append(size)
+        sections["names"] = [start, size]
+
+        section("geoname_ids", self.geoname_ids)
+        section("starts", self._starts)
+        section("entry_languages", entry_languages)
+        section("entry_name_ends", entry_name_ends)
+
+        return sections
+
+
+def source_tag(path):
+    """Return the size, mtime and sha1 of the path source file in a dict."""
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+
+    stat = os.stat(path)
+    return dict(
+        name=os.path.basename(path),
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+        sha1=sha1.hexdigest(),
+    )
+
+
+def write_translation_cache(path, data, tag):
+    """
+    Write data, a dict of model class: TranslationStore, to the path cache
+    file tagged with the tag dict.
+
+    The file is written next to path and renamed, so that a cache file is
+    always complete.
+    """
+    stores = []
+    with open(path + ".tmp", "wb") as f:
+        f.write(b"\0" * CACHE_HEADER.size)
+        for model_class, store in data.items():
+            sections = store.write(f)
+            stores.append(
+                dict(
+                    model=model_class._meta.label_lower,
+                    languages=store.languages,
+                    sections=sections,
+                )
+            )
+
+        header = json.dumps(
+            dict(
+                version=CACHE_VERSION,
+                byteorder=sys.byteorder,
+                tag=tag,
+                stores=stores,
+            )
+        ).encode("utf-8")
+        header_offset = f.tell()
+        f.write(header)
+        f.seek(0)
+        f.write(CACHE_HEADER.pack(CACHE_MAGIC, header_offset))
+    os.replace(path + ".tmp", path)
+
+
+def read_translation_cache(path, tag):
+    """
+    Return an ordered dict of model class: TranslationStore read from the
+    path cache file, or None if it does not exist or if it was not written
+    by this version for the tag dict.
+
+    The file is memory-mapped, so translations are only read from disk when
+    they are accessed.
+    """
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return None
+
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, header_offset = CACHE_HEADER.unpack_from(data)
+    if magic != CACHE_MAGIC:
+        return None
+
+    header = json.loads(bytes(data[header_offset:]).decode("utf-8"))
+    if (
+        header["version"] != CACHE_VERSION
+        or header["byteorder"] != sys.byteorder
+        or header["tag"] != tag
+    ):
+        return None
+
+    view = memoryview(data)
+
+    def section(sections, name, typecode=None):
+        offset, size = sections[name]
+        if typecode is None:
+            return view[offset : offset + size]
+        itemsize = array.array(typecode).itemsize
+        return view[offset : offset + size * itemsize].cast(typecode)
+
+    result = collections.OrderedDict()
+    for store in header["stores"]:
+        sections = store["sections"]
+        result[apps.get_model(store["model"])] = TranslationStore.from_sorted(
+            store["languages"],
+            section(sections, "geoname_ids", "q"),
+            section(sections, "starts", "Q"),
+            section(sections, "entry_languages", "H"),
+            section(sections, "entry_name_ends", "Q"),
+            section(sections, "names"),
+        )
+    return result
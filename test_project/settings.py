@@ -85,6 +85,8 @@ DATABASES = {
 
 if 'mysql' in DATABASES['default']['ENGINE']:
     DATABASES['default']['OPTIONS']['charset'] = 'utf8mb4'
+    # for the load-data import engine
+    DATABASES['default']['OPTIONS']['local_infile'] = 1
     DATABASES['default']['TEST'] = {
         'CHARSET': 'utf8mb4',
         'COLLATION': 'utf8mb4_unicode_ci',